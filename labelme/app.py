@@ -9,7 +9,6 @@ import re
 import webbrowser
 
 import imgviz
-import natsort
 from qtpy import QtCore
 from qtpy.QtCore import Qt
 from qtpy import QtGui
@@ -35,9 +34,9 @@ from labelme.widgets import UniqueLabelQListWidget
 from labelme.widgets import ZoomWidget
 from labelme.widgets import ColorDialog
 
-import json
-from labelme.segmentationTree import SegmentationTree
-from . import segmentationTree
+from . import segmentationTreeLoader
+from labelme import imagePyramid
+from labelme.imagePrefetcher import ImagePrefetcher
 
 # FIXME
 # - [medium] Set max zoom value to something big enough for FitWidth/Window
@@ -913,6 +912,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.recentFiles = []
         self.maxRecent = 7
         self.otherData = None
+        self.segTreeLoader = None
+        # threads loading the raster of a tree, one per tree
+        self.segTreeRasterThreads = {}
+        self.resumeSegmentSelection = False
+        self.prefetcher = ImagePrefetcher(
+            num_images=self._config["prefetch_images"],
+            flat=self._config["flat_segmentation_tree"],
+        )
         self.zoom_level = 100
         self.fit_window = False
         self.zoom_values = {}  # key=filename, value=(zoom_mode, zoom_value)
@@ -1143,6 +1150,9 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def setSegmentationTree(self):
         if self.canvas.segmentation_tree == None:
+            if self.segTreeLoader is not None:
+                self.status(self.tr("Segmentation tree is still loading"))
+                return False
             success = self.openSegmentationTreeFile()
             print(success)
             if not success:
@@ -1741,9 +1751,23 @@ class MainWindow(QtWidgets.QMainWindow):
         self.actions.keepPrevScale.setChecked(enabled)
 
     def onNewBrightnessContrast(self, qimage):
-        self.canvas.loadPixmap(
-            QtGui.QPixmap.fromImage(qimage), clear_shapes=False
-        )
+        self.setCanvasImage(qimage, clear_shapes=False)
+
+    def setCanvasImage(self, image, filename=None, clear_shapes=True):
+        if imagePyramid.isLargeImage(image):
+            # no full size pixmap, the canvas draws the visible tiles
+            cache_dirname = source_mtime = None
+            if filename is not None:
+                cache_dirname = imagePyramid.getImagePyramidDirname(filename)
+                source_mtime = osp.getmtime(filename)
+            self.canvas.loadImagePyramid(
+                imagePyramid.ImagePyramid(image, cache_dirname, source_mtime),
+                clear_shapes=clear_shapes,
+            )
+        else:
+            self.canvas.loadPixmap(
+                QtGui.QPixmap.fromImage(image), clear_shapes=clear_shapes
+            )
 
     def brightnessContrast(self, value):
         dialog = BrightnessContrastDialog(
@@ -1771,42 +1795,124 @@ class MainWindow(QtWidgets.QMainWindow):
     def loadSegTreeFromJSON(self, seg_tree_filename):
         if QtCore.QFile.exists(seg_tree_filename):
             try:
-                with open(seg_tree_filename, "r") as f:
-                    jsonSegTree = json.loads(f.read())
-                    self.canvas.segmentation_tree = SegmentationTree()
-                    self.canvas.contrast_levels = self.canvas.segmentation_tree.loadSegTreeFromDictArray(jsonSegTree)
-                    self.toggleDrawMode(self.canvas.createMode)
-                    return True
-            except IOError:
-                print("Error loading segmentation tree JSON")
-        return False
-    
-    def createSegTree(self, image_filename, seg_tree_filename):
-        if QtCore.QFile.exists(image_filename):
-            self.canvas.segmentation_tree, self.canvas.contrast_levels = segmentationTree.createSegTree(image_filename)
-
-            try:
-                self.canvas.segmentation_tree, self.canvas.contrast_levels = segmentationTree.createSegTree(image_filename)
-                self.canvas.segmentation_tree.createMissingChildren()
-                try:
-                    with open(seg_tree_filename, "w") as f:
-                        jsonSegTree = self.canvas.segmentation_tree.getSegTreeAsDictArray(self.canvas.contrast_levels)
-                        json.dump(jsonSegTree, f, ensure_ascii=False, indent=2)
-                except IOError:
-                    print("Error saving segmentation tree JSON")
+                self.cancelSegTreeLoading()
+                (
+                    self.canvas.segmentation_tree,
+                    self.canvas.contrast_levels,
+                ) = segmentationTreeLoader.readSegTreeFile(
+                    seg_tree_filename, self._config["flat_segmentation_tree"]
+                )
                 self.toggleDrawMode(self.canvas.createMode)
                 return True
-            except IOError:
-                print("Error creating segmentation tree from image")
+            except (IOError, ValueError):
+                print("Error loading segmentation tree JSON")
         return False
-    
+
+    def cancelSegTreeLoading(self):
+        if self.segTreeLoader is None:
+            return
+        # the worker stops at its next progress report, its results are
+        # dropped in segTreeLoaded
+        self.segTreeLoader.cancel()
+        self.segTreeLoader = None
+
     def loadSegTree(self, filename):
+        self.cancelSegTreeLoading()
         self.canvas.segmentation_tree = None
-        seg_tree_filename = osp.splitext(filename)[0] + "_seg_tree" + ".json"
-        
-        if self.loadSegTreeFromJSON(seg_tree_filename):
-            return True
-        return self.createSegTree(filename, seg_tree_filename)
+        # selecting segments needs the tree, come back to it on arrival
+        self.resumeSegmentSelection = self.canvas.createMode == "select"
+        if self.resumeSegmentSelection:
+            self.toggleDrawMode("edit")
+        seg_tree_filename = segmentationTreeLoader.getSegTreeFilename(filename)
+
+        seg_tree, contrast_levels = self.prefetcher.getSegTree(filename)
+        if seg_tree is not None:
+            self.setLoadedSegTree(seg_tree, contrast_levels, seg_tree_filename)
+            return
+
+        loader = segmentationTreeLoader.SegTreeLoader(
+            seg_tree_filename,
+            self.imageData,
+            parent=self,
+            pending=self.prefetcher.pendingSegTree(filename),
+            flat=self._config["flat_segmentation_tree"],
+        )
+        loader.progress.connect(self.segTreeLoadingProgress)
+        loader.built.connect(self.segTreeBuilt)
+        loader.loaded.connect(self.segTreeLoaded)
+        loader.failed.connect(self.segTreeLoadingFailed)
+        loader.finished.connect(loader.deleteLater)
+        self.segTreeLoader = loader
+        loader.start()
+
+    def segTreeLoadingProgress(self, message):
+        if self.sender() is self.segTreeLoader:
+            self.status(message)
+
+    def segTreeBuilt(self, seg_tree, contrast_levels):
+        if self.sender() is not self.segTreeLoader:
+            return
+        # usable while the loader fills the gaps between its segments
+        self.setLoadedSegTree(seg_tree, contrast_levels, None)
+
+    def segTreeLoaded(self, seg_tree, contrast_levels):
+        loader = self.sender()
+        if loader is not self.segTreeLoader:
+            return
+        self.segTreeLoader = None
+        if seg_tree is None:
+            return
+        save = loader.missing_children is not None
+        if save:
+            # the tree may be in use, it is only changed on the UI thread
+            seg_tree.addMissingChildren(loader.missing_children)
+        self.setLoadedSegTree(
+            seg_tree, contrast_levels, loader.seg_tree_filename, save
+        )
+
+    def setLoadedSegTree(
+        self, seg_tree, contrast_levels, seg_tree_filename, save=False
+    ):
+        """Show the tree, ``seg_tree_filename`` is None while it is incomplete.
+
+        With ``save`` the tree is written to ``seg_tree_filename`` before
+        its raster is loaded.
+        """
+        if seg_tree_filename is not None and seg_tree.raster is None:
+            self.startLoadingSegTreeRaster(
+                seg_tree, seg_tree_filename, contrast_levels if save else None
+            )
+        if self.canvas.segmentation_tree is seg_tree:
+            self.canvas.update()
+            return
+        self.canvas.segmentation_tree = seg_tree
+        self.canvas.contrast_levels = contrast_levels
+        if self.resumeSegmentSelection and self.canvas.createMode == "edit":
+            self.toggleDrawMode("select")
+        self.status(self.tr("Segmentation tree loaded"))
+
+    def startLoadingSegTreeRaster(
+        self, seg_tree, seg_tree_filename, contrast_levels
+    ):
+        self.segTreeRasterThreads = {
+            tree: thread
+            for tree, thread in self.segTreeRasterThreads.items()
+            if thread.is_alive()
+        }
+        # a prefetched tree shown again may still be loading its raster
+        if seg_tree in self.segTreeRasterThreads:
+            return
+        self.segTreeRasterThreads[
+            seg_tree
+        ] = segmentationTreeLoader.startLoadingSegTreeRaster(
+            seg_tree, seg_tree_filename, contrast_levels
+        )
+
+    def segTreeLoadingFailed(self, message):
+        if self.sender() is not self.segTreeLoader:
+            return
+        self.segTreeLoader = None
+        self.status(self.tr("Error creating segmentation tree: %s") % message)
 
     def loadFile(self, filename=None):
         """Load the specified file, or the last opened file if None."""
@@ -1837,6 +1943,7 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.output_dir:
             label_file_without_path = osp.basename(label_file)
             label_file = osp.join(self.output_dir, label_file_without_path)
+        image = None
         if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
             label_file
         ):
@@ -1859,12 +1966,19 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.labelFile.imagePath,
             )
             self.otherData = self.labelFile.otherData
+            # the label file holds or points to the prefetched image
+            imageData, image = self.prefetcher.getImage(filename)
+            if imageData != self.imageData:
+                image = None
         else:
-            self.imageData = LabelFile.load_image_file(filename)
+            self.imageData, image = self.prefetcher.getImage(filename)
+            if self.imageData is None:
+                self.imageData = LabelFile.load_image_file(filename)
             if self.imageData:
                 self.imagePath = filename
             self.labelFile = None
-        image = QtGui.QImage.fromData(self.imageData)
+        if image is None:
+            image = QtGui.QImage.fromData(self.imageData)
 
         if image.isNull():
             formats = [
@@ -1886,7 +2000,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.filename = filename
         if self._config["keep_prev"]:
             prev_shapes = self.canvas.shapes
-        self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
+        self.setCanvasImage(image, filename)
         flags = {k: False for k in self._config["flags"] or []}
         if self.labelFile:
             self.loadLabels(self.labelFile.shapes)
@@ -1941,6 +2055,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.toggleActions(True)
         self.canvas.setFocus()
         self.status(str(self.tr("Loaded %s")) % osp.basename(str(filename)))
+        if self.filename in self.imageList:
+            self.prefetcher.prefetch(
+                self.imageList, self.imageList.index(self.filename)
+            )
         return True
 
     def resizeEvent(self, event):
@@ -1971,15 +2089,15 @@ class MainWindow(QtWidgets.QMainWindow):
         h1 = self.centralWidget().height() - e
         a1 = w1 / h1
         # Calculate a new scale value based on the pixmap's aspect ratio.
-        w2 = self.canvas.pixmap.width() - 0.0
-        h2 = self.canvas.pixmap.height() - 0.0
+        w2 = self.canvas.imageRect().width() - 0.0
+        h2 = self.canvas.imageRect().height() - 0.0
         a2 = w2 / h2
         return w1 / w2 if a2 >= a1 else h1 / h2
 
     def scaleFitWidth(self):
         # The epsilon does not seem to work too well here.
         w = self.centralWidget().width() - 2.0
-        return w / self.canvas.pixmap.width()
+        return w / self.canvas.imageRect().width()
 
     def enableSaveImageWithData(self, enabled):
         self._config["store_data"] = enabled
@@ -1988,6 +2106,19 @@ class MainWindow(QtWidgets.QMainWindow):
     def closeEvent(self, event):
         if not self.mayContinue():
             event.ignore()
+        else:
+            self.cancelSegTreeLoading()
+            for loader in self.findChildren(
+                segmentationTreeLoader.SegTreeLoader
+            ):
+                loader.cancel()
+                loader.wait()
+            self.prefetcher.shutdown()
+            for thread in self.segTreeRasterThreads.values():
+                thread.join()
+            self.segTreeRasterThreads = {}
+            self.canvas.setImagePyramid(None)
+            segmentationTreeLoader.shutdownProcessPool()
         self.settings.setValue(
             "filename", self.filename if self.filename else ""
         )
@@ -2104,19 +2235,21 @@ class MainWindow(QtWidgets.QMainWindow):
         if not self.mayContinue():
             return False
         path = osp.dirname(str(self.filename)) if self.filename else "."
-        filters = self.tr("Segmentation Tree JSON and MATLAB files (%s)") % " ".join(["*.json", "*.mat"])
+        filters = self.tr("Segmentation Tree files (%s)") % " ".join(
+            ["*.bin", "*.json", "*.mat"]
+        )
         fileDialog = QtWidgets.QFileDialog(self)
         fileDialog.setFileMode(QtWidgets.QFileDialog.ExistingFile)
         fileDialog.setNameFilter(filters)
         fileDialog.setWindowTitle(
-            self.tr("%s - Choose Segmentation Tree JSON or MATLAB file") % __appname__,
+            self.tr("%s - Choose Segmentation Tree file") % __appname__,
         )
         fileDialog.setWindowFilePath(path)
         # fileDialog.setViewMode(FileDialogPreview.Detail)
         if fileDialog.exec_():
             fileName = fileDialog.selectedFiles()[0]
             if fileName:
-                if osp.splitext(fileName)[1] == ".json":
+                if osp.splitext(fileName)[1] in [".bin", ".json"]:
                     return self.loadSegTreeFromJSON(fileName)
         return False
 
@@ -2427,16 +2560,4 @@ class MainWindow(QtWidgets.QMainWindow):
         self.openNextImg(load=load)
 
     def scanAllImages(self, folderPath):
-        extensions = [
-            ".%s" % fmt.data().decode().lower()
-            for fmt in QtGui.QImageReader.supportedImageFormats()
-        ]
-
-        images = []
-        for root, dirs, files in os.walk(folderPath):
-            for file in files:
-                if file.lower().endswith(tuple(extensions)):
-                    relativePath = osp.join(root, file)
-                    images.append(relativePath)
-        images = natsort.os_sorted(images)
-        return images
+        return utils.scanAllImages(folderPath)
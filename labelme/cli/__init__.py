@@ -1,5 +1,6 @@
 # flake8: noqa
 
+from . import build_segtrees
 from . import draw_json
 from . import draw_label_png
 from . import json_to_dataset
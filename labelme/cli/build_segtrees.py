@@ -0,0 +1,147 @@
+import argparse
+import concurrent.futures
+import os
+import os.path as osp
+import time
+
+from labelme.logger import logger
+from labelme import segmentationTree
+from labelme.segmentationTreeLoader import convertSegTreeFile
+from labelme.segmentationTreeLoader import getJSONSegTreeFilename
+from labelme.segmentationTreeLoader import getSegTreeFilename
+from labelme.segmentationTreeLoader import getSegTreeRasterFilename
+from labelme.segmentationTreeLoader import readSegTreeFile
+from labelme.segmentationTreeLoader import writeSegTreeFile
+from labelme.utils import scanAllImages
+
+
+def isNewer(filename, source_filename):
+    return osp.exists(filename) and osp.getmtime(filename) >= osp.getmtime(
+        source_filename
+    )
+
+
+def isUpToDate(image_file):
+    seg_tree_file = getSegTreeFilename(image_file)
+    return isNewer(seg_tree_file, image_file) and isNewer(
+        getSegTreeRasterFilename(seg_tree_file), seg_tree_file
+    )
+
+
+def needsBuilding(image_file, failed):
+    try:
+        return not isUpToDate(image_file) and failed.get(
+            image_file
+        ) != osp.getmtime(image_file)
+    except OSError:
+        # removed or renamed since the directory was scanned
+        return False
+
+
+def buildSegTree(image_file):
+    seg_tree_file = getSegTreeFilename(image_file)
+    json_file = getJSONSegTreeFilename(seg_tree_file)
+    if isNewer(seg_tree_file, image_file):
+        # only the raster is missing
+        pass
+    elif isNewer(json_file, image_file):
+        # upgrade JSON caches instead of building them again
+        convertSegTreeFile(json_file, seg_tree_file)
+    else:
+        seg_tree, contrast_levels = segmentationTree.createSegTree(image_file)
+        seg_tree.createMissingChildren()
+        writeSegTreeFile(seg_tree_file, seg_tree, contrast_levels)
+
+    # the raster is made from the tree as it is read back, the order of
+    # its nodes is the one the raster refers to
+    seg_tree, _ = readSegTreeFile(seg_tree_file)
+    seg_tree.buildRaster().save(getSegTreeRasterFilename(seg_tree_file))
+    return seg_tree_file
+
+
+def buildSegTrees(image_files, jobs=None, failed=None):
+    """Build the missing or outdated caches, returns the number built.
+
+    Images that failed are recorded in ``failed`` with their modification
+    time, and are skipped until they change.
+    """
+    if failed is None:
+        failed = {}
+    image_files = [f for f in image_files if needsBuilding(f, failed)]
+    if not image_files:
+        return 0
+
+    num_built = 0
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = {executor.submit(buildSegTree, f): f for f in image_files}
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            image_file = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                try:
+                    failed[image_file] = osp.getmtime(image_file)
+                except OSError:
+                    # removed since, nothing to remember
+                    pass
+                logger.error(
+                    "[{}/{}] Failed {}: {}".format(
+                        i + 1, len(image_files), image_file, e
+                    )
+                )
+                continue
+            num_built += 1
+            logger.info(
+                "[{}/{}] Built {}".format(i + 1, len(image_files), image_file)
+            )
+    return num_built
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute segmentation tree caches of images.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("dir", help="directory of images")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and build caches of new or changed images",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=5,
+        help="seconds between directory scans in watch mode",
+    )
+    args = parser.parse_args()
+
+    image_files = scanAllImages(args.dir)
+    failed = {}
+    num_built = buildSegTrees(image_files, args.jobs, failed)
+    logger.info(
+        "Built {} segmentation trees for {} images".format(
+            num_built, len(image_files)
+        )
+    )
+    if not args.watch:
+        return
+
+    logger.info("Watching {}".format(args.dir))
+    try:
+        while True:
+            time.sleep(args.interval)
+            buildSegTrees(scanAllImages(args.dir), args.jobs, failed)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
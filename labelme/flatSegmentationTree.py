@@ -0,0 +1,358 @@
+import numpy as np
+import shapely
+from qtpy import QtCore
+from qtpy import QtGui
+
+from labelme.segmentationTreeRaster import SegTreeRaster
+from labelme.segmentationTreeSelection import SelectionUnion
+from labelme.segmentationTreeSelection import bufferSegment
+
+
+def preOrderParents(num_children):
+    """Returns the parent of each node, -1 for roots, from the number of
+    children of the nodes listed in pre-order."""
+    parents = np.full(len(num_children), -1, dtype=np.int32)
+    # nodes still missing children and how many
+    stack = []
+    for i, n in enumerate(np.asarray(num_children).tolist()):
+        if stack:
+            parents[i] = stack[-1][0]
+            stack[-1][1] -= 1
+            if stack[-1][1] == 0:
+                stack.pop()
+        if n:
+            stack.append([i, n])
+    return parents
+
+
+class FlatSegmentationTree(object):
+    """Structure-of-arrays form of a SegmentationTree.
+
+    Nodes are numbered in pre-order, so the subtree of node ``i`` is the
+    range ``[i, subtree_end[i])`` and whole-tree queries are NumPy
+    operations instead of recursive calls.  It offers the same operations
+    the canvas uses on SegmentationTree.
+    """
+
+    scale = 1.0
+
+    def __init__(self, contrast_levels, num_children, coords, coord_offsets):
+        num_nodes = len(num_children)
+        self.contrast_levels = np.asarray(contrast_levels, dtype=np.int32)
+        # left memory mapped when read from the cache
+        self.coords = np.asarray(coords)
+        self.coord_offsets = np.asarray(coord_offsets, dtype=np.int64)
+
+        self.parent = preOrderParents(num_children)
+        self.subtree_end = np.arange(1, num_nodes + 1, dtype=np.int64)
+        for i in range(num_nodes - 1, 0, -1):
+            parent = self.parent[i]
+            self.subtree_end[parent] = max(
+                self.subtree_end[parent], self.subtree_end[i]
+            )
+        # children of node i are child_index[child_start[i]:child_end[i]]
+        self.child_index = np.arange(1, num_nodes, dtype=np.int32)[
+            np.argsort(self.parent[1:], kind="stable")
+        ]
+        self.child_end = np.cumsum(num_children).astype(np.int64)
+        self.child_start = self.child_end - num_children
+
+        num_coords = np.diff(self.coord_offsets)
+        rings = shapely.linearrings(
+            self.coords,
+            indices=np.repeat(np.arange(num_nodes), num_coords),
+        )
+        self.polygons = shapely.polygons(rings)
+        self.bbox = shapely.bounds(self.polygons)
+        self.area = shapely.area(self.polygons)
+        self.selected = np.zeros(num_nodes, dtype=bool)
+        self.hovered = np.zeros(num_nodes, dtype=bool)
+        self.raster = None
+        self._paths = {}
+        self.level_paths = {}
+        self.buffered = np.full(num_nodes, None, dtype=object)
+        self.selection_union = SelectionUnion()
+
+    def __len__(self):
+        return len(self.parent)
+
+    @classmethod
+    def fromArrays(cls, contrastLevels, nodes, coords):
+        """Create from the arrays of SegmentationTree.getSegTreeAsArrays."""
+        nodes = np.asarray(nodes)
+        # the node contrast levels are the third column
+        tree = cls(
+            nodes[:, 2],
+            nodes[:, 1].astype(np.int64),
+            coords,
+            np.concatenate([[0], np.cumsum(nodes[:, 0], dtype=np.int64)]),
+        )
+        return tree, np.asarray(contrastLevels).tolist()
+
+    @classmethod
+    def fromSegTree(cls, seg_tree, contrastLevels):
+        return cls.fromArrays(*seg_tree.getSegTreeAsArrays(contrastLevels))
+
+    def getSegTreeAsArrays(self, contrastLevelList):
+        nodes = np.stack(
+            [
+                np.diff(self.coord_offsets),
+                self.child_end - self.child_start,
+                self.contrast_levels,
+            ],
+            axis=1,
+        ).astype(np.int32)
+        return (
+            np.array(contrastLevelList, dtype=np.int32),
+            nodes,
+            self.coords,
+        )
+
+    def getSegTreeAsDictArray(self, contrastLevelList):
+        nodes = [
+            {
+                "polygon": self.getCoords(i),
+                "children": int(self.child_end[i] - self.child_start[i]),
+                "contrast_level": int(self.contrast_levels[i]),
+            }
+            for i in range(len(self))
+        ]
+        return [contrastLevelList] + nodes
+
+    def getCoords(self, index=0):
+        start, end = self.coord_offsets[index : index + 2]
+        return self.coords[start:end].tolist()
+
+    def children(self, index):
+        return self.child_index[
+            self.child_start[index] : self.child_end[index]
+        ]
+
+    def _containing(self, x, y):
+        """Returns the indices of the nodes containing the point."""
+        candidates = np.flatnonzero(
+            (self.bbox[:, 0] <= x)
+            & (self.bbox[:, 1] <= y)
+            & (self.bbox[:, 2] >= x)
+            & (self.bbox[:, 3] >= y)
+        )
+        return candidates[shapely.contains_xy(self.polygons[candidates], x, y)]
+
+    def _reachable(self, nodes):
+        """Keep the nodes whose ancestors all are in ``nodes`` as well."""
+        reached = np.zeros(len(self), dtype=bool)
+        for i in nodes.tolist():
+            parent = self.parent[i]
+            reached[i] = parent < 0 or reached[parent]
+        return nodes[reached[nodes]]
+
+    def setRaster(self, raster):
+        """Pick segments with ``raster`` instead of point in polygon tests."""
+        self.raster = raster
+
+    def buildRaster(self):
+        return SegTreeRaster.build(
+            [self.getCoords(i) for i in range(len(self))],
+            self.parent,
+            self.area,
+            int(np.ceil(np.nanmax(self.bbox[:, 2]))) + 1,
+            int(np.ceil(np.nanmax(self.bbox[:, 3]))) + 1,
+        )
+
+    def loadRaster(self, filename):
+        return SegTreeRaster.load(filename, self.parent)
+
+    def updateHovering(self, pos):
+        self.hovered[:] = False
+        if self.raster is not None:
+            # every other node from the deepest one up to the root
+            ancestors = self.raster.ancestors(self.raster.leafAt(*pos[:2]))
+            self.hovered[list(ancestors)[::2]] = True
+            return self.hovered[0]
+        # a node is hovered when it contains the point and none of its
+        # children is hovered
+        for i in self._containing(pos[0], pos[1])[::-1].tolist():
+            self.hovered[i] = not self.hovered[self.children(i)].any()
+        return self.hovered[0]
+
+    def editSegmentSelectionAtContrastLevel(self, pos, contrastLevel):
+        if self.raster is not None:
+            index = self.raster.leafAt(pos[0], pos[1])
+            if index < 0:
+                return False
+            if self.contrast_levels[index] == contrastLevel:
+                self.selected[index] = not self.selected[index]
+            return True
+        reached = self._reachable(self._containing(pos[0], pos[1]))
+        if not len(reached):
+            return False
+        has_reached_child = np.zeros(len(self), dtype=bool)
+        has_reached_child[self.parent[reached[1:]]] = True
+        toggled = reached[
+            (self.contrast_levels[reached] == contrastLevel)
+            & ~has_reached_child[reached]
+        ]
+        self.selected[toggled] = ~self.selected[toggled]
+        return True
+
+    def selectSegmentsWithPercentAreaAndBoundary(self, selection_polygon):
+        x0, y0, x1, y1 = selection_polygon.bounds
+        candidates = np.flatnonzero(
+            (self.bbox[:, 0] <= x1)
+            & (self.bbox[:, 1] <= y1)
+            & (self.bbox[:, 2] >= x0)
+            & (self.bbox[:, 3] >= y0)
+            & (self.area > 0)
+        )
+        shapely.prepare(selection_polygon)
+        try:
+            intersection_area = shapely.area(
+                shapely.intersection(
+                    self.polygons[candidates], selection_polygon
+                )
+            )
+        except shapely.errors.GEOSException:
+            print("invalid object")
+            return
+        candidates = candidates[
+            intersection_area / self.area[candidates] > 0.95
+        ]
+        qualified = []
+        for i in candidates.tolist():
+            start, end = self.coord_offsets[i : i + 2]
+            points = self.coords[start:end]
+            enclosed = shapely.contains_xy(
+                selection_polygon, points[:, 0], points[:, 1]
+            )
+            if enclosed.sum() / len(points) > 0.95:
+                qualified.append(i)
+        # only the topmost qualifying nodes are selected
+        skip_until = 0
+        for i in qualified:
+            if i < skip_until:
+                continue
+            self.selected[i] = True
+            skip_until = self.subtree_end[i]
+
+    def editSegmentSelectionWithVariableWidthContour(
+        self, contour, adding, parent_selected
+    ):
+        x0, y0, x1, y1 = contour.bounds
+        candidates = np.flatnonzero(
+            (self.bbox[:, 0] <= x1)
+            & (self.bbox[:, 1] <= y1)
+            & (self.bbox[:, 2] >= x0)
+            & (self.bbox[:, 3] >= y0)
+            & (self.area > 0)
+        )
+        ratio = np.zeros(len(self))
+        ratio[candidates] = (
+            shapely.area(
+                shapely.intersection(self.polygons[candidates], contour)
+            )
+            / self.area[candidates]
+        )
+        return self._editWithContour(0, ratio, adding, parent_selected)
+
+    def _editWithContour(self, index, ratio, adding, parent_selected):
+        # explicit stack, nodes are expanded on the way down and their
+        # selection updated from the results of their children on the
+        # way up
+        modified = {}
+        stack = [(index, parent_selected, False)]
+        while stack:
+            i, parent_selected, expanded = stack.pop()
+            if expanded:
+                children = self.children(i)
+                child_modified = np.array(
+                    [modified.pop(child) for child in children.tolist()],
+                    dtype=bool,
+                )
+                modified[i] = False
+                if child_modified.any() and not adding:
+                    if self.selected[i] or parent_selected:
+                        self.selected[children[~child_modified]] = True
+                        if self.selected[i]:
+                            self.selected[i] = False
+                        else:
+                            modified[i] = True
+            elif ratio[i] == 0:
+                modified[i] = False
+            elif ratio[i] > 0.9:
+                self.removeSelection(i)
+                if adding:
+                    self.selected[i] = True
+                modified[i] = True
+            else:
+                stack.append((i, parent_selected, True))
+                stack.extend(
+                    (child, parent_selected or self.selected[i], False)
+                    for child in self.children(i)[::-1].tolist()
+                )
+        return modified[index]
+
+    def getPainterPath(self, index):
+        path = self._paths.get(index)
+        if path is None:
+            path = QtGui.QPainterPath()
+            path.addPolygon(
+                QtGui.QPolygonF(
+                    [QtCore.QPointF(x, y) for x, y in self.getCoords(index)]
+                )
+            )
+            path.closeSubpath()
+            self._paths[index] = path
+        return path
+
+    def getContrastLevelPath(self, contrast_level):
+        """Returns the outlines of all the nodes of the level as one path."""
+        path = self.level_paths.get(contrast_level)
+        if path is None:
+            path = QtGui.QPainterPath()
+            for i in np.flatnonzero(
+                self.contrast_levels == contrast_level
+            ).tolist():
+                path.addPath(self.getPainterPath(i))
+            self.level_paths[contrast_level] = path
+        return path
+
+    def paintContrastLevel(self, painter, curr_contrast_level, color):
+        pen = QtGui.QPen(color)
+        pen.setWidth(max(1, int(round(2.0 / self.scale))))
+        painter.setPen(pen)
+        painter.drawPath(self.getContrastLevelPath(curr_contrast_level))
+
+        at_level = self.contrast_levels == curr_contrast_level
+        for i in np.flatnonzero(self.selected & ~at_level).tolist():
+            painter.drawPath(self.getPainterPath(i))
+        for i in np.flatnonzero(
+            self.selected | (self.hovered & at_level)
+        ).tolist():
+            painter.fillPath(self.getPainterPath(i), color)
+
+    def removeSelection(self, index=0):
+        self.selected[index : self.subtree_end[index]] = False
+
+    def getBufferedPolygons(self, indices):
+        missing = indices[self.buffered[indices] == None]  # noqa: E711
+        self.buffered[missing] = bufferSegment(self.polygons[missing])
+        return self.buffered[indices]
+
+    def getSelectionUnion(self):
+        """Returns the union of the selected segments."""
+        if self.raster is not None and self.raster.topology is not None:
+            # exact union along the pixel edges
+            return self.raster.getSelectionUnion(self.selected)
+        selected = np.flatnonzero(self.selected)
+        # buffer the newly selected nodes in one call
+        self.getBufferedPolygons(selected)
+        return self.selection_union.update(
+            selected.tolist(), self.buffered.__getitem__
+        )
+
+    def collectSelectedSegments(self):
+        return list(self.getBufferedPolygons(np.flatnonzero(self.selected)))
+
+    def selectedSegmentContainsPoint(self, point):
+        reached = self._reachable(self._containing(point.x, point.y))
+        return bool(self.selected[reached].any())
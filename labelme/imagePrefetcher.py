@@ -0,0 +1,207 @@
+import collections
+import concurrent.futures
+import os.path as osp
+import threading
+
+from qtpy import QtGui
+
+from labelme.imagePyramid import isLargeImage
+from labelme.label_file import LabelFile
+from labelme.logger import logger
+from labelme import segmentationTreeLoader
+
+
+class PrefetchEntry(object):
+
+    __slots__ = [
+        "imageData",
+        "image",
+        "seg_tree",
+        "contrast_levels",
+        "future",
+        "wanted",
+    ]
+
+    def __init__(self):
+        self.imageData = None
+        self.image = None
+        self.seg_tree = None
+        self.contrast_levels = None
+        self.future = None
+        self.wanted = True
+
+
+class ImagePrefetcher(object):
+    """Load the images around the current one in background threads.
+
+    The image bytes, decoded QImage and segmentation tree of the next and
+    previous ``num_images`` files are kept in an LRU cache so that stepping
+    through the image list does not wait for them.  Large images, which
+    are shown through a pyramid, are not prefetched, neither are files
+    that failed to load until they are modified.
+    """
+
+    def __init__(self, num_images=2, max_workers=2, flat=False):
+        self.num_images = num_images
+        self.flat = flat
+        self.capacity = 2 * num_images + 1
+        self.image_hits = self.image_misses = 0
+        self.seg_tree_hits = self.seg_tree_misses = 0
+        self._entries = collections.OrderedDict()
+        # modification time of the files that failed or were skipped
+        self._skipped = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        if num_images > 0:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers
+            )
+
+    @property
+    def hits(self):
+        return self.image_hits + self.seg_tree_hits
+
+    @property
+    def misses(self):
+        return self.image_misses + self.seg_tree_misses
+
+    def _lookup(self, filename):
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None:
+                self._entries.move_to_end(filename)
+            return entry
+
+    def getImage(self, filename):
+        """Returns ``(imageData, QImage)`` or ``(None, None)`` on a miss."""
+        entry = self._lookup(filename)
+        if entry is None or entry.image is None:
+            self.image_misses += 1
+            return None, None
+        self.image_hits += 1
+        return entry.imageData, entry.image
+
+    def getSegTree(self, filename):
+        """Returns ``(seg_tree, contrast_levels)`` or ``(None, None)``."""
+        entry = self._lookup(filename)
+        if entry is None or entry.seg_tree is None:
+            self.seg_tree_misses += 1
+            return None, None
+        self.seg_tree_hits += 1
+        # the tree may have been used before, start from a clean selection
+        entry.seg_tree.removeSelection()
+        return entry.seg_tree, entry.contrast_levels
+
+    def pendingSegTree(self, filename):
+        """Returns the future of a running prefetch of ``filename``."""
+        entry = self._lookup(filename)
+        if entry is None or entry.future is None or entry.future.done():
+            return None
+        return entry.future
+
+    def prefetch(self, imageList, index):
+        """Prefetch the neighbours of ``imageList[index]``."""
+        if self._executor is None:
+            return
+        # closest first, and the next image before the previous one
+        filenames = []
+        for offset in range(1, self.num_images + 1):
+            for i in (index + offset, index - offset):
+                if 0 <= i < len(imageList):
+                    filenames.append(imageList[i])
+
+        with self._lock:
+            for filename, entry in self._entries.items():
+                if filename not in filenames and filename != imageList[index]:
+                    entry.wanted = False
+                    if entry.future is not None:
+                        entry.future.cancel()
+            for filename in filenames:
+                entry = self._entries.get(filename)
+                if (
+                    entry is None
+                    or (
+                        entry.seg_tree is None
+                        and (entry.future is None or entry.future.done())
+                    )
+                ) and not self._isSkipped(filename):
+                    entry = PrefetchEntry()
+                    entry.future = self._executor.submit(
+                        self._load, filename, entry
+                    )
+                    self._entries[filename] = entry
+                if entry is not None:
+                    entry.wanted = True
+            # the current image is the most recently used one
+            if imageList[index] in self._entries:
+                self._entries.move_to_end(imageList[index])
+            while len(self._entries) > self.capacity:
+                _, entry = self._entries.popitem(last=False)
+                entry.wanted = False
+                if entry.future is not None:
+                    entry.future.cancel()
+
+    def _isSkipped(self, filename):
+        mtime = self._skipped.get(filename)
+        if mtime is None:
+            return False
+        try:
+            return osp.getmtime(filename) == mtime
+        except OSError:
+            return True
+
+    def _skip(self, filename, mtime):
+        with self._lock:
+            self._skipped[filename] = mtime
+
+    def _load(self, filename, entry):
+        def progress(message):
+            if not entry.wanted:
+                raise segmentationTreeLoader.SegTreeLoadCancelled
+
+        mtime = None
+        try:
+            mtime = osp.getmtime(filename)
+            # read from the header, before loading anything
+            if isLargeImage(QtGui.QImageReader(filename).size()):
+                self._skip(filename, mtime)
+                return
+            imageData = LabelFile.load_image_file(filename)
+            if not imageData:
+                self._skip(filename, mtime)
+                return
+            image = QtGui.QImage.fromData(imageData)
+            if image.isNull():
+                self._skip(filename, mtime)
+                return
+            entry.imageData, entry.image = imageData, image
+
+            seg_tree_filename = segmentationTreeLoader.getSegTreeFilename(
+                filename
+            )
+            seg_tree, contrast_levels = segmentationTreeLoader.loadSegTree(
+                seg_tree_filename, imageData, progress, self.flat
+            )
+            entry.seg_tree, entry.contrast_levels = seg_tree, contrast_levels
+            return seg_tree, contrast_levels
+        except segmentationTreeLoader.SegTreeLoadCancelled:
+            raise
+        except Exception as e:
+            logger.error("Failed prefetching {}: {}".format(filename, e))
+            if mtime is not None:
+                self._skip(filename, mtime)
+            raise
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.wanted = False
+                if entry.future is not None:
+                    entry.future.cancel()
+            self._entries.clear()
+
+    def shutdown(self):
+        self.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
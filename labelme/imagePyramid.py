@@ -0,0 +1,289 @@
+import collections
+import concurrent.futures
+import math
+import os
+import os.path as osp
+import threading
+
+from qtpy import QtCore
+from qtpy import QtGui
+
+from labelme.logger import logger
+
+
+TILE_SIZE = 512
+# images from this size on are shown through a pyramid instead of a pixmap
+PYRAMID_MIN_PIXELS = 4096 * 4096
+# about 1MB each
+MAX_CACHED_TILES = 192
+
+
+def getImagePyramidDirname(filename):
+    return osp.splitext(filename)[0] + "_tiles"
+
+
+def isLargeImage(image):
+    return image.width() * image.height() >= PYRAMID_MIN_PIXELS
+
+
+class ImagePyramid(QtCore.QObject):
+    """Tiles of an image at halving resolutions, made when first shown.
+
+    Level 0 is the image itself, level ``l`` is scaled down by ``2 ** l``
+    and the last level fits in a single tile.  Tiles are made in worker
+    threads, level 0 ones are cut from the image and the others are
+    scaled down from the four tiles under them and saved to the cache
+    directory, if any, to be reused the next time the image is opened.
+    Only the last used tiles are kept in memory.
+    """
+
+    tileLoaded = QtCore.Signal()
+
+    def __init__(
+        self,
+        image,
+        cache_dirname=None,
+        source_mtime=None,
+        parent=None,
+        max_workers=2,
+    ):
+        super(ImagePyramid, self).__init__(parent)
+        self.image = image
+        self.cache_dirname = cache_dirname
+        # cached tiles older than the image are stale
+        self.source_mtime = source_mtime
+        self.num_levels = 1
+        while max(self.levelSize(self.num_levels - 1)) > TILE_SIZE:
+            self.num_levels += 1
+        # drawn where tiles are missing, sampling is cheap at this size
+        width, height = self.levelSize(self.num_levels - 1)
+        self.preview = image.scaled(
+            width,
+            height,
+            QtCore.Qt.IgnoreAspectRatio,
+            QtCore.Qt.FastTransformation,
+        )
+        self._tiles = collections.OrderedDict()
+        self._pending = set()
+        self._wanted = set()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        )
+
+    def width(self):
+        return self.image.width()
+
+    def height(self):
+        return self.image.height()
+
+    def size(self):
+        return self.image.size()
+
+    def rect(self):
+        return self.image.rect()
+
+    def levelSize(self, level):
+        return (
+            max(1, math.ceil(self.image.width() / 2**level)),
+            max(1, math.ceil(self.image.height() / 2**level)),
+        )
+
+    def getLevel(self, scale):
+        """Returns the coarsest level with at least one pixel per screen
+        pixel at ``scale``."""
+        if scale >= 1:
+            return 0
+        return min(self.num_levels - 1, int(math.floor(math.log2(1 / scale))))
+
+    def getTileFilename(self, level, tx, ty):
+        return osp.join(
+            self.cache_dirname, "{}_{}_{}.png".format(level, tx, ty)
+        )
+
+    def getCachedTile(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def storeTile(self, key, tile):
+        with self._lock:
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > MAX_CACHED_TILES:
+                self._tiles.popitem(last=False)
+
+    def makeTile(self, level, tx, ty):
+        """Returns a tile, making it in the calling thread if needed."""
+        key = (level, tx, ty)
+        tile = self.getCachedTile(key)
+        if tile is not None:
+            return tile
+
+        width, height = self.levelSize(level)
+        x, y = tx * TILE_SIZE, ty * TILE_SIZE
+        tile_width = min(TILE_SIZE, width - x)
+        tile_height = min(TILE_SIZE, height - y)
+        if level == 0:
+            tile = self.image.copy(x, y, tile_width, tile_height)
+            self.storeTile(key, tile)
+            return tile
+
+        filename = None
+        if self.cache_dirname is not None:
+            filename = self.getTileFilename(level, tx, ty)
+            if osp.exists(filename) and (
+                self.source_mtime is None
+                or osp.getmtime(filename) >= self.source_mtime
+            ):
+                tile = QtGui.QImage(filename)
+                if not tile.isNull():
+                    self.storeTile(key, tile)
+                    return tile
+
+        # the up to four tiles under this one at the finer level
+        finer_width, finer_height = self.levelSize(level - 1)
+        finer = QtGui.QImage(
+            min(2 * TILE_SIZE, finer_width - 2 * x),
+            min(2 * TILE_SIZE, finer_height - 2 * y),
+            QtGui.QImage.Format_ARGB32,
+        )
+        painter = QtGui.QPainter(finer)
+        for dy in range(2):
+            for dx in range(2):
+                if (
+                    2 * x + dx * TILE_SIZE >= finer_width
+                    or 2 * y + dy * TILE_SIZE >= finer_height
+                ):
+                    continue
+                painter.drawImage(
+                    dx * TILE_SIZE,
+                    dy * TILE_SIZE,
+                    self.makeTile(level - 1, 2 * tx + dx, 2 * ty + dy),
+                )
+        painter.end()
+        tile = finer.scaled(
+            tile_width,
+            tile_height,
+            QtCore.Qt.IgnoreAspectRatio,
+            QtCore.Qt.SmoothTransformation,
+        )
+        self.storeTile(key, tile)
+
+        if filename is not None:
+            try:
+                os.makedirs(self.cache_dirname, exist_ok=True)
+                tile.save(filename)
+            except OSError as e:
+                logger.warning(
+                    "Failed caching image tile {}: {}".format(filename, e)
+                )
+        return tile
+
+    def loadTile(self, key):
+        try:
+            with self._lock:
+                if key not in self._wanted:
+                    # scrolled away before it was made
+                    return
+            self.makeTile(*key)
+            self.tileLoaded.emit()
+        except Exception as e:
+            logger.error("Failed making image tile {}: {}".format(key, e))
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def getTile(self, level, tx, ty):
+        """Returns a tile if it was made, or schedules it and returns None"""
+        key = (level, tx, ty)
+        tile = self.getCachedTile(key)
+        if tile is not None:
+            return tile
+        with self._lock:
+            if key in self._pending or self._executor is None:
+                return None
+            self._pending.add(key)
+            self._wanted.add(key)
+        self._executor.submit(self.loadTile, key)
+        return None
+
+    def getTileRange(self, level, rect):
+        """Returns the tile columns and rows covering an image rect."""
+        size = TILE_SIZE * 2**level
+        width, height = self.levelSize(level)
+        columns = math.ceil(width / TILE_SIZE)
+        rows = math.ceil(height / TILE_SIZE)
+        return (
+            range(
+                max(0, int(rect.left() // size)),
+                min(columns, int(rect.right() // size) + 1),
+            ),
+            range(
+                max(0, int(rect.top() // size)),
+                min(rows, int(rect.bottom() // size) + 1),
+            ),
+        )
+
+    def paint(self, painter, rect, scale):
+        """Draws the part of the image in ``rect`` seen at ``scale``."""
+        rect = rect & QtCore.QRectF(self.rect())
+        if rect.isEmpty():
+            return
+        level = self.getLevel(scale)
+        size = TILE_SIZE * 2**level
+        columns, rows = self.getTileRange(level, rect)
+        keys = [(level, tx, ty) for ty in rows for tx in columns]
+        with self._lock:
+            self._wanted = set(keys)
+
+        tiles = [(key, self.getTile(*key)) for key in keys]
+        if any(tile is None for _, tile in tiles):
+            preview_scale = 2 ** (self.num_levels - 1)
+            painter.drawImage(
+                rect,
+                self.preview,
+                QtCore.QRectF(
+                    rect.left() / preview_scale,
+                    rect.top() / preview_scale,
+                    rect.width() / preview_scale,
+                    rect.height() / preview_scale,
+                ),
+            )
+
+        # tiles are drawn on whole device pixels, edges falling inside a
+        # pixel would be blended with the background and leave seams
+        transform = painter.worldTransform()
+        painter.save()
+        painter.resetTransform()
+        for (level, tx, ty), tile in tiles:
+            if tile is None:
+                continue
+            target = transform.mapRect(
+                QtCore.QRectF(
+                    tx * size,
+                    ty * size,
+                    tile.width() * 2**level,
+                    tile.height() * 2**level,
+                )
+            )
+            left, top = round(target.left()), round(target.top())
+            painter.drawImage(
+                QtCore.QRect(
+                    left,
+                    top,
+                    round(target.right()) - left,
+                    round(target.bottom()) - top,
+                ),
+                tile,
+            )
+        painter.restore()
+
+    def shutdown(self):
+        with self._lock:
+            self._wanted = set()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
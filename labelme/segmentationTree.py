@@ -1,42 +1,45 @@
-import cv2
+import concurrent.futures
+
 import numpy as np
-from scipy.io import loadmat
-from shapely.geometry import Polygon, MultiPolygon, Point
-from shapely.ops import nearest_points, unary_union
-from shapely.validation import make_valid, explain_validity
-import json
+from shapely.geometry import Polygon, MultiPolygon
+import shapely
+from shapely import STRtree
+from shapely.ops import unary_union
 from qtpy import QtCore
 from qtpy import QtGui
 
-import subprocess
-import os 
+from labelme.flatSegmentationTree import preOrderParents
+from labelme.segmentationTreeBuilder import createRegionList
+from labelme.segmentationTreeBuilder import makeRegionList
+from labelme.segmentationTreeRaster import SegTreeRaster
+from labelme.segmentationTreeSelection import SelectionUnion
+from labelme.segmentationTreeSelection import bufferSegment
+
 
 def ReadRegionList(generalDataDir, boundaryDataDir):
-    data = np.fromfile(generalDataDir, dtype=np.int32)
-    num_regions = data[0]
-    regions = []
-    num_boundary_points = []
-    boundary_points_start_index = []
-    index_sum = 0
-    for i in range(0,num_regions):
-        index_sum = index_sum + data[i*3+1]
-        boundary_points_start_index.append(index_sum)
-        num_boundary_points.append(data[i*3+1])
-        regions.append([])
-        regions[i].append(int(data[i*3+2]))
-        regions[i].append(int(data[i*3+3]))
-
-    array = np.fromfile(boundaryDataDir, dtype=np.int32).reshape(index_sum,2)
-    boundary_points = np.split(array, boundary_points_start_index)
-    boundary_points = [[[int(boundary_point[1]), int(boundary_point[0])] for boundary_point in boundary_point_list] for boundary_point_list in boundary_points]
-
-    for i in range(0,num_regions):
-        regions[i].append(boundary_points[i])
-
-    return regions, num_regions
-
-def createSegTree(image_filename):
-# def convertMatToTree(filename):
+    data = np.memmap(generalDataDir, dtype=np.int32, mode="r")
+    num_regions = int(data[0])
+    # [num_boundary_points, size, contrast_level] per region, followed by
+    # the parent index when the file was written with merge order
+    num_fields = 4 if len(data) == 1 + 4 * num_regions else 3
+    fields = data[1 : 1 + num_fields * num_regions].reshape(
+        num_regions, num_fields
+    )
+    # boundary points are stored as (row, column), flip them to [x, y]
+    boundary_points = np.memmap(
+        boundaryDataDir, dtype=np.int32, mode="r"
+    ).reshape(-1, 2)[:, ::-1]
+    return makeRegionList(
+        fields[:, 0],
+        fields[:, 1],
+        fields[:, 2],
+        boundary_points,
+        fields[:, 3] if num_fields == 4 else None,
+    )
+
+
+def createSegTree(image_file, progress=None, regions=None):
+    # def convertMatToTree(filename):
     # matlab_file = loadmat(filename)
     # key = list(matlab_file.keys())[3]
     # segmentation_tree_array = loadmat(filename)[key][0]
@@ -52,199 +55,561 @@ def createSegTree(image_filename):
     #     if len(boundary) > 3:
     #         boundary = [(coord[0]-1, coord[1]-1) for coord in boundary]
     #         contour = np.flip(boundary, 1)
-    #         
+    #
     #         if len(contour) < 3:
     #             continue
     #         new_node = SegmentationTree(contour, contrast)
 
     #         if new_node.polygon.is_valid == False:
     #             new_node.polygon = new_node.polygon.buffer(0.5).simplify(0)
-    #             if new_node.polygon.geom_type != "MultiPolygon" and len(new_node.getCoords()) < 3:
+    #             if (
+    #                 new_node.polygon.geom_type != "MultiPolygon"
+    #                 and len(new_node.getCoords()) < 3
+    #             ):
     #                 pass
     #         if new_node.polygon.geom_type == "MultiPolygon":
     #             for polygon in list(new_node.polygon.geoms):
     #                 if len(list(polygon.exterior.coords)) < 3:
     #                     continue
-    #                 trees.append(SegmentationTree(list(polygon.exterior.coords), contrast))
+    #                 trees.append(
+    #                     SegmentationTree(
+    #                         list(polygon.exterior.coords), contrast
+    #                     )
+    #                 )
     #         else:
     #             trees.append(new_node)
     # print("in")
-    baseDir = os.getcwd() + "/"
-    # print(baseDir)
-    image_name = os.path.splitext(os.path.split(image_filename)[1])[0]
-    # print(baseDir + "segmentation_tree.exe", image_filename, baseDir + "temp\\", image_name)
-    result = subprocess.run([baseDir + "segmentation_tree.out", image_filename, baseDir + "temp/", image_name])
-    # print(result.returncode)
-    # print("1")
-    generalDataDir = baseDir + "temp/"+ image_name + "_GeneralData.bin"
-    boundaryDataDir = baseDir + "temp/"+ image_name + "_BoundaryData.bin"
-    # print(generalDataDir, boundaryDataDir)
-    regions, num_regions = ReadRegionList(generalDataDir, boundaryDataDir)
+    if regions is None:
+        regions, num_regions = createRegionList(image_file, progress)
+    else:
+        # e.g. read with ReadRegionList from the files of the
+        # segmentation_tree binary, without the merge order in older ones
+        regions, num_regions = regions
+    if progress is not None:
+        progress("Building segmentation tree")
+
+    trees, region_trees, contrast_levels = createRegionTrees(
+        regions, num_regions
+    )
+    if not trees:
+        raise ValueError("Segmentation produced no regions")
+
+    if all(region[3] is not None for region in regions):
+        roots = linkSegTreeByMergeOrder(regions, region_trees)
+    else:
+        roots = linkSegTreeByContainment(trees)
+    rootNode = roots[0]
+    if len(roots) > 1:
+        polygons = []
+        for root in roots:
+            polygons.append(root.polygon)
+        polygonsCombination = MultiPolygon(polygons)
+        rootNode = SegmentationTree(
+            list(polygonsCombination.convex_hull.exterior.coords), -1
+        )
+        for root in roots:
+            rootNode.children.append(root)
 
+    sortedContrastLevels = list(contrast_levels.keys())
+    sortedContrastLevels.sort(reverse=True)
+    return rootNode, sortedContrastLevels
+
+
+def createRegionTrees(regions, num_regions):
+    """Returns the unlinked nodes of the regions, all of them and per
+    region, as a region split in several polygons gets a node per part,
+    and the contrast levels."""
     trees = []
+    region_trees = []
     contrast_levels = {}
-    for i in range(0,num_regions):
+    for i in range(0, num_regions):
         boundary = regions[i][2]
         contrast = regions[i][1]
         contrast_levels[contrast] = contrast
+        region_trees.append([])
         if len(boundary) < 3:
             continue
 
         new_node = SegmentationTree(boundary, contrast)
-        if new_node.polygon.is_valid == False:
+        if not new_node.polygon.is_valid:
             new_node.polygon = new_node.polygon.buffer(0.5).simplify(0)
-            if new_node.polygon.geom_type != "MultiPolygon" and len(new_node.getCoords()) < 3:
+            if (
+                new_node.polygon.geom_type != "MultiPolygon"
+                and len(new_node.getCoords()) < 3
+            ):
                 pass
         if new_node.polygon.geom_type == "MultiPolygon":
             for polygon in list(new_node.polygon.geoms):
                 if len(list(polygon.exterior.coords)) < 3:
                     continue
-                trees.append(SegmentationTree(list(polygon.exterior.coords), contrast))
+                region_trees[i].append(
+                    SegmentationTree(list(polygon.exterior.coords), contrast)
+                )
         else:
-            trees.append(new_node)
-    # print("2")
-    # sort shapes based on area
-    is_sorted = True
-    prev_area = trees[0].polygon.area
-    for i in range(1, len(trees)):
-        if trees[i].polygon.area > prev_area:
-            # print("ERROR: Unsorted list of trees")
-            is_sorted = False
-    # print("3")
-    if not is_sorted:
-        trees_copy = []
-        for i in range(0, len(trees)):
-            max = -1
-            k = 0
-            for j in range(0, len(trees)):
-                if trees[j] == None:
-                    continue
+            region_trees[i].append(new_node)
+        trees += region_trees[i]
+    return trees, region_trees, contrast_levels
 
-                if max == -1:
-                    max = trees[j].polygon.area
-                    k = j
-                    continue
 
-                if max < trees[j].polygon.area:
-                    max = trees[j].polygon.area
-                    k = j
-            trees_copy.append(trees[k])
-            trees[k] = None
-        trees = trees_copy
-
-        is_sorted = True
-        prev_area = trees[0].polygon.area
-        for i in range(1, len(trees)):
-            if trees[i].polygon.area > prev_area:
-                print("ERROR: Unsorted list of trees")
-                is_sorted = False
-    # print("4")
-    if is_sorted:
-        roots = []
-        # check containment of shapes to build tree
-        for i in range(len(trees)-1,-1,-1):
-            parent_found = False
-            for j in range(i-1,-1,-1):
-                if (trees[j].polygon.contains(trees[i].polygon)):
-                    # make child
-                    trees[j].children.append(trees[i])
-                    parent_found = True
-                    break
-            if not parent_found:
-                roots.append(trees[i])
-    rootNode = trees[0]
-    if len(roots) > 1:
-        polygons = []
-        for root in roots:
-            polygons.append(root.polygon)
-        polygonsCombination = MultiPolygon(polygons)
-        rootNode = SegmentationTree(list(polygonsCombination.convex_hull.exterior.coords), -1)
-        for root in roots:
-            rootNode.children.append(root)
-        
-    sortedContrastLevels = list(contrast_levels.keys())
-    sortedContrastLevels.sort(reverse=True)
-    return rootNode, sortedContrastLevels
+# number of chunks the nodes are split in to find their missing children
+MISSING_CHILDREN_CHUNKS = 16
+
+
+def findMissingPolygons(polygon, childPolygons):
+    """Returns the parts of a segment not covered by its children."""
+    newPolygons = []
+    childrenUnion = unary_union(childPolygons)
+    if childrenUnion.area > 0:
+        difference = polygon.difference(childrenUnion)
+        if difference.geom_type == "Polygon":
+            if difference.area > 5:
+                newPolygons.append(difference)
+        else:
+            for part in list(difference.geoms):
+                if part.area > 5:
+                    newPolygons.append(part)
+    return newPolygons
+
+
+def findMissingPolygonsOfNodes(tasks):
+    return [
+        findMissingPolygons(polygon, childPolygons)
+        for polygon, childPolygons in tasks
+    ]
+
+
+def linkSegTreeByMergeOrder(regions, region_trees):
+    """Attach the nodes of every region to the region it was merged into.
+
+    Regions come parents first, so a single pass from the leaves up links
+    the whole tree without any geometric test, apart from picking the part
+    of a parent that was split into several polygons.
+    """
+    roots = []
+    for i in range(len(regions) - 1, -1, -1):
+        parent = regions[i][3]
+        # regions too small to be traced hand their children up
+        while parent >= 0 and not region_trees[parent]:
+            parent = regions[parent][3]
+        for tree in region_trees[i]:
+            if parent < 0:
+                roots.append(tree)
+                continue
+            candidates = region_trees[parent]
+            parent_tree = candidates[0]
+            if len(candidates) > 1:
+                point = tree.polygon.representative_point()
+                parent_tree = max(
+                    candidates,
+                    key=lambda c: (c.polygon.contains(point), c.polygon.area),
+                )
+            parent_tree.children.append(tree)
+    return roots[::-1]
+
+
+def linkSegTreeByContainment(trees):
+    """Attach every node to the smallest node containing it.
+
+    Used for region lists that do not record the merge order.
+    """
+    # sort shapes based on area, largest first
+    areas = np.array([tree.polygon.area for tree in trees])
+    trees = [trees[i] for i in np.argsort(-areas, kind="stable")]
+    polygons = [tree.polygon for tree in trees]
+
+    # parent candidates of a shape are larger shapes whose bounding box
+    # contains its bounding box, ordered from the smallest one
+    bounds = shapely.bounds(polygons)
+    child_indices, candidate_indices = STRtree(polygons).query(polygons)
+    child_bounds = bounds[child_indices]
+    candidate_bounds = bounds[candidate_indices]
+    is_candidate = (
+        (candidate_indices < child_indices)
+        & np.all(candidate_bounds[:, :2] <= child_bounds[:, :2], axis=1)
+        & np.all(candidate_bounds[:, 2:] >= child_bounds[:, 2:], axis=1)
+    )
+    child_indices = child_indices[is_candidate]
+    candidate_indices = candidate_indices[is_candidate]
+    order = np.lexsort((-candidate_indices, child_indices))
+    child_indices = child_indices[order]
+    candidate_indices = candidate_indices[order]
+    starts = np.searchsorted(child_indices, np.arange(len(trees)))
+    ends = np.searchsorted(child_indices, np.arange(len(trees)), "right")
+    # a parent must contain a point inside its child, which is much cheaper
+    # to test on a prepared polygon than full containment
+    inner_points = shapely.get_coordinates(shapely.point_on_surface(polygons))
+
+    roots = []
+    # check containment of shapes to build tree
+    for i in range(len(trees) - 1, -1, -1):
+        parent_found = False
+        x, y = inner_points[i]
+        for j in candidate_indices[starts[i] : ends[i]].tolist():
+            shapely.prepare(polygons[j])
+            if not shapely.contains_xy(polygons[j], x, y):
+                continue
+            if polygons[j].contains(polygons[i]):
+                # make child
+                trees[j].children.append(trees[i])
+                parent_found = True
+                break
+        if not parent_found:
+            roots.append(trees[i])
+    shapely.destroy_prepared(polygons)
+    return roots
+
+
+def linkPreOrderNodes(trees, num_children):
+    """Adds the children of the trees listed in pre-order."""
+    parents = preOrderParents(num_children)
+    for tree, parent in zip(trees, parents.tolist()):
+        if parent >= 0:
+            trees[parent].children.append(tree)
+
+
+class SegTreeCache(object):
+    """State of a whole tree, only kept by its root."""
+
+    __slots__ = [
+        "raster",
+        "raster_nodes",
+        "level_nodes",
+        "level_paths",
+        "selected_nodes",
+        "hovered_nodes",
+        "selection_union",
+        "paths",
+        "buffered",
+    ]
+
+    def __init__(self):
+        self.raster = self.raster_nodes = None
+        self.hovered_nodes = []
+        self.selection_union = SelectionUnion()
+        # outlines and buffered polygons of the nodes, by node
+        self.paths = {}
+        self.buffered = {}
+        self.resetContrastLevelIndex()
+
+    def resetContrastLevelIndex(self):
+        self.level_nodes = self.level_paths = self.selected_nodes = None
+
+    def getPainterPath(self, node):
+        path = self.paths.get(node)
+        if path is None:
+            path = self.paths[node] = node.getPainterPath()
+        return path
+
+    def getBufferedPolygon(self, node):
+        polygon = self.buffered.get(node)
+        if polygon is None:
+            polygon = self.buffered[node] = node.getBufferedPolygon()
+        return polygon
+
 
 class SegmentationTree(object):
 
+    # nodes only keep their coordinates, the shapely polygon is built the
+    # first time it is needed
+    __slots__ = [
+        "_coords",
+        "_polygon",
+        "bbox",
+        "area",
+        "children",
+        "selected",
+        "contrast_level",
+        "hovered",
+        "subtree_bbox",
+        "_cache",
+    ]
+
     scale = 1.0
 
-    def __init__(self, pts=None, contrast_level=None):
-        self.polygon = Polygon(pts).simplify(0)
+    def __init__(
+        self,
+        pts=None,
+        contrast_level=None,
+        polygon=None,
+        coords=None,
+        bbox=None,
+        area=None,
+    ):
         self.children = []
         self.selected = False
         self.contrast_level = contrast_level
         self.hovered = False
-    
+        self.subtree_bbox = None
+        self._cache = None
+        if coords is not None:
+            self._coords = coords
+            self._polygon = None
+            self.bbox = bbox
+            self.area = area
+        else:
+            if polygon is None:
+                polygon = Polygon(pts).simplify(0)
+            self.polygon = polygon
+
+    @property
+    def polygon(self):
+        if self._polygon is None:
+            self._polygon = Polygon(self._coords)
+        return self._polygon
+
+    @polygon.setter
+    def polygon(self, polygon):
+        self._polygon = polygon
+        self._coords = None
+        self.subtree_bbox = None
+        self.bbox = polygon.bounds
+        self.area = polygon.area
+
+    @property
+    def cache(self):
+        """The state of the tree, when the node is used as its root."""
+        if self._cache is None:
+            self._cache = SegTreeCache()
+        return self._cache
+
+    @property
+    def raster(self):
+        return self.cache.raster
+
+    def getPreparedPolygon(self):
+        polygon = self.polygon
+        shapely.prepare(polygon)
+        return polygon
+
     def getCoords(self):
-        return list(self.polygon.exterior.coords)
+        """Returns the ``(N, 2)`` array of the exterior coordinates."""
+        if self._coords is None:
+            self._coords = shapely.get_coordinates(self._polygon.exterior)
+        return self._coords
+
+    def preOrder(self, visit=None, descend=None):
+        """Yields the nodes of the subtree, parents before their children.
+
+        Nodes for which ``visit`` returns False are skipped with their
+        subtree.  ``descend`` is called once the node was yielded, its
+        children are only visited when it returns True.
+        """
+        stack = [self]
+        pop, extend = stack.pop, stack.extend
+        while stack:
+            node = pop()
+            if visit is not None and not visit(node):
+                continue
+            yield node
+            if descend is None or descend(node):
+                extend(node.children[::-1])
+
+    def postOrder(self, visit=None):
+        """Returns the nodes of the subtree, children before their parents.
+
+        Nodes for which ``visit`` returns False are skipped with their
+        subtree.
+        """
+        # a pre-order walk taking the last child first, reversed
+        nodes = []
+        stack = [self]
+        pop, extend, append = stack.pop, stack.extend, nodes.append
+        while stack:
+            node = pop()
+            if visit is None or visit(node):
+                append(node)
+                extend(node.children)
+        return reversed(nodes)
+
+    def getPainterPath(self):
+        path = QtGui.QPainterPath()
+        path.addPolygon(
+            QtGui.QPolygonF(
+                [QtCore.QPointF(x, y) for x, y in self.getCoords().tolist()]
+            )
+        )
+        path.closeSubpath()
+        return path
+
+    def getContrastLevelNodes(self, contrast_level):
+        cache = self.cache
+        if cache.level_nodes is None:
+            cache.level_nodes = {}
+            for node in self.preOrder():
+                cache.level_nodes.setdefault(node.contrast_level, []).append(
+                    node
+                )
+        return cache.level_nodes.get(contrast_level, [])
+
+    def getContrastLevelPath(self, contrast_level):
+        """Returns the outlines of all the nodes of the level as one path."""
+        cache = self.cache
+        if cache.level_paths is None:
+            cache.level_paths = {}
+        path = cache.level_paths.get(contrast_level)
+        if path is None:
+            path = QtGui.QPainterPath()
+            for node in self.getContrastLevelNodes(contrast_level):
+                path.addPath(cache.getPainterPath(node))
+            cache.level_paths[contrast_level] = path
+        return path
+
+    def getSelectedNodes(self):
+        # cleared by the methods editing the selection
+        cache = self.cache
+        if cache.selected_nodes is None:
+            cache.selected_nodes = [
+                node for node in self.preOrder() if node.selected
+            ]
+        return cache.selected_nodes
 
     def selectSegmentsWithPercentAreaAndBoundary(self, selection_polygon):
-        try:
+        self.cache.selected_nodes = None
+        shapely.prepare(selection_polygon)
+        self.selectSegmentsWithPercentAreaAndBoundaryHelper(
+            selection_polygon, selection_polygon.bounds
+        )
+
+    def isMostlyInsideSelection(self, selection_polygon):
+        if self.area <= 0:
+            return False
+        if not selection_polygon.contains(self.polygon):
+            # the covered part is at most the part of the selection in the bbox
+            if (
+                shapely.clip_by_rect(selection_polygon, *self.bbox).area
+                <= 0.95 * self.area
+            ):
+                return False
             intersection = self.polygon.intersection(selection_polygon)
-            if self.polygon.area > 0 and (intersection.area / self.polygon.area) > 0.95:
-                segment_points = self.getCoords()
-                num_boundary_points = len(segment_points)
-                num_boundary_points_enclosed = 0
-                for point in segment_points:
-                    if selection_polygon.contains(Point(point)):
-                        num_boundary_points_enclosed += 1
-                
-                if (num_boundary_points_enclosed / num_boundary_points) > 0.95:
-                    self.selected = True
-                    return
-        except:
-            print('invalid object')
-        
-        for child in self.children:
-                child.selectSegmentsWithPercentAreaAndBoundary(selection_polygon)
+            if (intersection.area / self.area) <= 0.95:
+                return False
+        segment_points = self.getCoords()
+        enclosed = shapely.contains_xy(
+            selection_polygon, segment_points[:, 0], segment_points[:, 1]
+        )
+        return (np.count_nonzero(enclosed) / len(segment_points)) > 0.95
+
+    def selectSegmentsWithPercentAreaAndBoundaryHelper(
+        self, selection_polygon, bounds
+    ):
+        def overlapsSelection(node):
+            # no node of a subtree outside of the selection bbox can qualify
+            x0, y0, x1, y1 = node.getSubtreeBBox()
+            return not (
+                x0 > bounds[2]
+                or y0 > bounds[3]
+                or x1 < bounds[0]
+                or y1 < bounds[1]
+            )
+
+        qualified = set()
+        for node in self.preOrder(
+            overlapsSelection, lambda node: node not in qualified
+        ):
+            try:
+                if node.isMostlyInsideSelection(selection_polygon):
+                    node.selected = True
+                    qualified.add(node)
+            except shapely.errors.GEOSException:
+                print("invalid object")
 
     def groupChildSelection(self):
         allChildrenSelected = True
         for child in self.children:
             allChildrenSelected = allChildrenSelected and child.selected
-                
+
         if allChildrenSelected:
             self.removeSelection()
             self.selected = True
             return True
         return False
 
-    def editSegmentSelectionWithVariableWidthContour(self, contour, adding, parent_selected):
-        # TODO optimize to not check all segments when parents don't overlap
-            
-        intersection = self.polygon.intersection(contour)
-        if self.polygon.area == 0 or (intersection.area / self.polygon.area) == 0:
-            return False
-        elif (intersection.area / self.polygon.area) > 0.9:
-            self.removeSelection()
-            if adding and not self.selected:
-                self.selected = True
+    def editSegmentSelectionWithVariableWidthContour(
+        self, contour, adding, parent_selected
+    ):
+        self.cache.selected_nodes = None
+        shapely.prepare(contour)
+        return self.editSegmentSelectionWithContourHelper(
+            contour, contour.bounds, adding, parent_selected
+        )
+
+    def missesContour(self, contour, bounds):
+        x0, y0, x1, y1 = bounds
+        if (
+            self.area == 0
+            or self.bbox[0] > x1
+            or self.bbox[1] > y1
+            or self.bbox[2] < x0
+            or self.bbox[3] < y0
+        ):
             return True
-        
-        modified = False
-        modified_children = []
-        for child in self.children:
-            child_modified = child.editSegmentSelectionWithVariableWidthContour(contour, adding, parent_selected or self.selected)
-            modified = modified or child_modified
-            if child_modified:
-                modified_children.append(child)
+        polygon = self.polygon
+        return not contour.intersects(polygon) or contour.touches(polygon)
 
-        if modified:
+    def isMostlyCoveredByContour(self, contour):
+        polygon = self.polygon
+        if contour.contains(polygon):
+            return True
+        # the covered part is at most the part of the contour in the bbox
+        if shapely.clip_by_rect(contour, *self.bbox).area <= 0.9 * self.area:
+            return False
+        return (polygon.intersection(contour).area / self.area) > 0.9
+
+    def editSegmentSelectionWithContourHelper(
+        self, contour, bounds, adding, parent_selected
+    ):
+        # explicit stack, nodes are expanded on the way down and their
+        # selection updated from the results of their children on the
+        # way up
+        modified = {}
+        stack = [(self, parent_selected, False)]
+        while stack:
+            node, parent_selected, expanded = stack.pop()
+            if expanded:
+                modified_children = [
+                    child for child in node.children if modified.pop(child)
+                ]
+                modified[node] = node.updateSelectionFromChildren(
+                    modified_children, adding, parent_selected
+                )
+            # a node missed by the contour skips its whole subtree
+            elif node.missesContour(contour, bounds):
+                modified[node] = False
+            elif node.isMostlyCoveredByContour(contour):
+                node.removeSelection()
+                if adding and not node.selected:
+                    node.selected = True
+                modified[node] = True
+            else:
+                stack.append((node, parent_selected, True))
+                stack.extend(
+                    (child, parent_selected or node.selected, False)
+                    for child in reversed(node.children)
+                )
+        return modified[self]
+
+    def updateSelectionFromChildren(
+        self, modified_children, adding, parent_selected
+    ):
+        if modified_children:
             if adding:
-                # TODO fix grouping because a segment's children don't always span the entire segment so it could be included even when it shouldn't
+                # TODO fix grouping because a segment's children don't
+                # always span the entire segment so it could be included
+                # even when it shouldn't
                 # return self.groupChildSelection()
                 return False
             elif self.selected or parent_selected:
                 for child in self.children:
                     child_unmodified = True
-                    # TODO can lead to removing more than intended when a segments children don't span the entire parent's segment since there won't be children to cover the non removed areas
+                    # TODO can lead to removing more than intended when a
+                    # segments children don't span the entire parent's
+                    # segment since there won't be children to cover the
+                    # non removed areas
                     for modified_child in modified_children:
                         if modified_child is child:
                             child_unmodified = False
                             break
-                    
+
                     if child_unmodified:
                         child.selected = True
 
@@ -254,119 +619,340 @@ class SegmentationTree(object):
                 return True
 
         return False
-    
+
     def editSegmentSelectionAtContrastLevel(self, pos, contrastLevel):
-        if self.polygon == None or not self.polygon.contains(Point(pos)):
-            return False
+        cache = self.cache
+        cache.selected_nodes = None
+        if cache.raster is not None:
+            index = cache.raster.leafAt(pos[0], pos[1])
+            if index < 0:
+                return False
+            node = cache.raster_nodes[index]
+            if node.contrast_level == contrastLevel:
+                node.selected = not node.selected
+            return True
 
-        childUpdated = False
-        for child in self.children:
-            childUpdated |= child.editSegmentSelectionAtContrastLevel(pos, contrastLevel)
-            
-        if self.contrast_level == contrastLevel and not childUpdated:
-            self.selected = not self.selected
-        
+        # the deepest nodes containing the point among those reached by
+        # descending through nodes containing it
+        reached = list(
+            self.preOrder(lambda node: node.containsPoint(pos[0], pos[1]))
+        )
+        if not reached:
+            return False
+        reached_set = set(reached)
+        for node in reached:
+            if node.contrast_level == contrastLevel and not any(
+                child in reached_set for child in node.children
+            ):
+                node.selected = not node.selected
         return True
 
     def paintContrastLevel(self, painter, curr_contrast_level, color):
-        if ((self.contrast_level == curr_contrast_level) or self.selected) and self.polygon != None:
-            pen = QtGui.QPen(color)
-            # Try using integer sizes for smoother drawing(?)
-            pen.setWidth(max(1, int(round(2.0 / self.scale))))
-            painter.setPen(pen)
-
-            line_path = QtGui.QPainterPath()
-            line_path.moveTo(QtCore.QPointF(self.getCoords()[0][0],self.getCoords()[0][1]))
-
-            for i, p in enumerate(self.getCoords()):
-                line_path.lineTo(QtCore.QPointF(p[0],p[1]))
-            line_path.lineTo(QtCore.QPointF(self.getCoords()[0][0],self.getCoords()[0][1]))
-
-            painter.drawPath(line_path)
-            if self.hovered or self.selected:
-                painter.fillPath(line_path, color)
-        
-        for child in self.children:
-            child.paintContrastLevel(painter, curr_contrast_level, color)
+        pen = QtGui.QPen(color)
+        # Try using integer sizes for smoother drawing(?)
+        pen.setWidth(max(1, int(round(2.0 / self.scale))))
+        painter.setPen(pen)
+        painter.drawPath(self.getContrastLevelPath(curr_contrast_level))
+
+        cache = self.cache
+        for node in self.getSelectedNodes():
+            if node.contrast_level != curr_contrast_level:
+                painter.drawPath(cache.getPainterPath(node))
+            painter.fillPath(cache.getPainterPath(node), color)
+        for node in cache.hovered_nodes:
+            if (
+                node.contrast_level == curr_contrast_level
+                and not node.selected
+            ):
+                painter.fillPath(cache.getPainterPath(node), color)
 
     def removeSelection(self):
-        self.selected = False
-        for child in self.children:
-            child.removeSelection()
-
-    def updateHovering(self,pos):
-        self.hovered = childHovered = False
-        for child in self.children:
-            childHovered |= child.updateHovering(pos)
-        if not childHovered:
-            self.hovered = self.polygon.contains(Point(pos))
+        for node in self.preOrder():
+            node.selected = False
+        if self._cache is not None:
+            self._cache.selected_nodes = None
+
+    def updateHovering(self, pos):
+        cache = self.cache
+        # only the nodes hovered by the previous call need to be cleared
+        for node in cache.hovered_nodes:
+            node.hovered = False
+        cache.hovered_nodes = []
+        if cache.raster is not None:
+            # every other node from the deepest one up to the root
+            index = cache.raster.leafAt(pos[0], pos[1])
+            for depth, index in enumerate(cache.raster.ancestors(index)):
+                if depth % 2 == 0:
+                    cache.raster_nodes[index].hovered = True
+                    cache.hovered_nodes.append(cache.raster_nodes[index])
+            return self.hovered
+        return self.updateHoveringHelper(pos[0], pos[1], cache.hovered_nodes)
+
+    def updateHoveringHelper(self, x, y, hovered_nodes):
+        # a node is hovered when it contains the point and none of its
+        # children is hovered, only subtrees whose bbox holds the point can be
+        def holdsPoint(node):
+            x0, y0, x1, y1 = node.getSubtreeBBox()
+            return x0 <= x <= x1 and y0 <= y <= y1
+
+        for node in self.postOrder(holdsPoint):
+            node.hovered = not any(
+                child.hovered for child in node.children
+            ) and bool(shapely.contains_xy(node.getPreparedPolygon(), x, y))
+            if node.hovered:
+                hovered_nodes.append(node)
         return self.hovered
-        
+
+    def getSubtreeBBox(self):
+        """Returns the bbox of the node and all its descendants.
+
+        Descendants can stick out of the node, as invalid outlines are
+        buffered when the tree is built.
+        """
+        if self.subtree_bbox is None:
+            # children first, subtrees already known are not walked again
+            for node in self.postOrder(lambda node: node.subtree_bbox is None):
+                x0, y0, x1, y1 = node.bbox
+                for child in node.children:
+                    cx0, cy0, cx1, cy1 = child.subtree_bbox
+                    if cx0 != cx0:
+                        # empty polygon, its bbox is nan
+                        continue
+                    x0, y0 = min(x0, cx0), min(y0, cy0)
+                    x1, y1 = max(x1, cx1), max(y1, cy1)
+                node.subtree_bbox = (x0, y0, x1, y1)
+        return self.subtree_bbox
+
+    def containsPoint(self, x, y):
+        x0, y0, x1, y1 = self.bbox
+        if not (x0 <= x <= x1 and y0 <= y <= y1):
+            return False
+        return bool(shapely.contains_xy(self.getPreparedPolygon(), x, y))
+
+    def getBufferedPolygon(self):
+        return bufferSegment(self.polygon)
+
+    def getSelectionUnion(self):
+        """Returns the union of the selected segments."""
+        cache = self.cache
+        if cache.raster is not None and cache.raster.topology is not None:
+            # exact union along the pixel edges
+            return cache.raster.getSelectionUnion(
+                [node.selected for node in cache.raster_nodes]
+            )
+        return cache.selection_union.update(
+            self.getSelectedNodes(), cache.getBufferedPolygon
+        )
+
     def collectSelectedSegments(self):
-        selectedSegments = []
-        if self.selected:
-            selectedSegments.append(self.polygon.buffer(0.5))
-        for child in self.children:
-            selectedSegments += child.collectSelectedSegments()
-        return selectedSegments
-    
+        return [
+            self.cache.getBufferedPolygon(node)
+            for node in self.preOrder()
+            if node.selected
+        ]
+
     def convertSegTreeToDictArray(self):
-        nodes = [{
-            "polygon": self.getCoords(),
-            "children": len(self.children),
-            "contrast_level": self.contrast_level
-        }]
-        for child in self.children:
-            nodes += child.convertSegTreeToDictArray()
-        return nodes
+        return [
+            {
+                "polygon": node.getCoords().tolist(),
+                "children": len(node.children),
+                "contrast_level": node.contrast_level,
+            }
+            for node in self.preOrder()
+        ]
 
     def convertDictArrayToSegTree(self, dict):
         contrastLevelList = dict[0]
-        self.convertDictArrayToSegTreeHelper(dict, 1)
+        trees = []
+        for dictArrayIndex in range(1, len(dict)):
+            tree = self if dictArrayIndex == 1 else SegmentationTree()
+            tree._cache = None
+            tree.polygon = Polygon(dict[dictArrayIndex]["polygon"]).simplify(0)
+            tree.contrast_level = dict[dictArrayIndex]["contrast_level"]
+            tree.children = []
+            trees.append(tree)
+        linkPreOrderNodes(trees, [node["children"] for node in dict[1:]])
         return contrastLevelList
 
-    def convertDictArrayToSegTreeHelper(self, dict, dictArrayIndex):
-        self.polygon = Polygon(dict[dictArrayIndex]["polygon"]).simplify(0)
-        self.contrast_level = dict[dictArrayIndex]["contrast_level"]
-        num_children = dict[dictArrayIndex]["children"]
-        self.children = [None] * num_children
-        for childIndex in range(0,num_children):
-            new_child = SegmentationTree()
-            dictArrayIndex = new_child.convertDictArrayToSegTreeHelper(dict, dictArrayIndex+1)
-            self.children[childIndex] = new_child
-        return dictArrayIndex
-    
     def getSegTreeAsDictArray(self, contrastLevelList):
         return [contrastLevelList] + self.convertSegTreeToDictArray()
 
     def loadSegTreeFromDictArray(self, dictArraySegTree):
         return self.convertDictArrayToSegTree(dictArraySegTree)
 
-    def createMissingChildren(self):
-        newPolygons = []
-        childPolygons = [i.polygon for i in self.children]
-        childrenUnion = unary_union(childPolygons)
-        if childrenUnion.area > 0:
-            difference = self.polygon.difference(childrenUnion)
-            if difference.geom_type == "Polygon":
-                if difference.area > 5:
-                    newPolygons.append(difference)
-            else:
-                for polygon in list(difference.geoms):
-                    if polygon.area > 5:
-                        newPolygons.append(polygon)
-            for polygon in newPolygons:
-                self.children.append(SegmentationTree(list(polygon.exterior.coords), self.children[0].contrast_level))
+    def getPreOrderNodes(self):
+        """Returns the nodes in pre-order and the index of their parent."""
+        nodes = list(self.preOrder())
+        parents = preOrderParents([len(node.children) for node in nodes])
+        return nodes, parents.tolist()
+
+    def setRaster(self, raster):
+        """Pick segments with ``raster`` instead of point in polygon tests."""
+        cache = self.cache
+        cache.raster_nodes = list(self.preOrder())
+        cache.raster = raster
+
+    def buildRaster(self):
+        nodes, parents = self.getPreOrderNodes()
+        x0, y0, x1, y1 = self.getSubtreeBBox()
+        return SegTreeRaster.build(
+            [node.getCoords() for node in nodes],
+            parents,
+            [node.area for node in nodes],
+            int(np.ceil(x1)) + 1,
+            int(np.ceil(y1)) + 1,
+        )
+
+    def loadRaster(self, filename):
+        _, parents = self.getPreOrderNodes()
+        return SegTreeRaster.load(filename, parents)
+
+    def getSegTreeAsArrays(self, contrastLevelList):
+        """Flatten the tree in pre-order for the binary cache.
+
+        Returns the contrast levels, an ``(N, 3)`` int32 array of
+        ``[num_coords, num_children, contrast_level]`` per node and the
+        ``(M, 2)`` float32 array of all the node coordinates.
+        """
+        nodes = list(self.preOrder())
+        coords = [node.getCoords() for node in nodes]
+        return (
+            np.array(contrastLevelList, dtype=np.int32),
+            np.array(
+                [
+                    [len(node_coords), len(node.children), node.contrast_level]
+                    for node, node_coords in zip(nodes, coords)
+                ],
+                dtype=np.int32,
+            ).reshape(-1, 3),
+            np.concatenate(coords).astype(np.float32),
+        )
+
+    def loadSegTreeFromArrays(self, contrastLevels, nodes, coords):
+        # nodes keep views into the coordinates, which stay memory mapped
+        coords = np.asarray(coords)
+        num_coords = nodes[:, 0].astype(np.int64)
+        ends = np.cumsum(num_coords)
+        starts = ends - num_coords
+        # bounding boxes and shoelace areas of all the rings at once
+        has_coords = num_coords > 0
+        bboxes = np.full((len(nodes), 4), np.nan)
+        areas = np.zeros(len(nodes))
+        if has_coords.any():
+            bboxes[has_coords, :2] = np.minimum.reduceat(
+                coords, starts[has_coords]
+            )
+            bboxes[has_coords, 2:] = np.maximum.reduceat(
+                coords, starts[has_coords]
+            )
+            # areas are summed in double precision
+            x, y = coords[:, 0].astype(np.float64), coords[:, 1].astype(
+                np.float64
+            )
+            cross = x * np.roll(y, -1) - np.roll(x, -1) * y
+            # rings are closed, the last point does not pair with the next ring
+            cross[ends[has_coords] - 1] = 0
+            areas[has_coords] = (
+                np.abs(np.add.reduceat(cross, starts[has_coords])) / 2
+            )
 
-        for child in self.children:
-            child.createMissingChildren()
+        self.children = []
+        self._coords = coords[starts[0] : ends[0]]
+        self._polygon = None
+        self.bbox = tuple(bboxes[0].tolist())
+        self.subtree_bbox = None
+        self._cache = None
+        self.area = areas[0]
+        trees = [self] + [
+            SegmentationTree(
+                coords=coords[start:end], bbox=tuple(bbox), area=area
+            )
+            for start, end, bbox, area in zip(
+                starts[1:].tolist(),
+                ends[1:].tolist(),
+                bboxes[1:].tolist(),
+                areas[1:].tolist(),
+            )
+        ]
+        for tree, contrast_level in zip(trees, nodes[:, 2].tolist()):
+            tree.contrast_level = contrast_level
+        linkPreOrderNodes(trees, nodes[:, 1])
+        return contrastLevels.tolist()
+
+    def findMissingChildren(self, executor=None, progress=None):
+        """Returns ``(node, polygons)`` for the parts of nodes their
+        children miss.
+
+        Nodes are independent of each other and split in chunks, run by the
+        workers of ``executor`` if any.  ``progress`` is called as chunks
+        are done, it may raise to abort, the chunks not started yet are then
+        cancelled.
+        """
+        nodes = [node for node in self.getPreOrderNodes()[0] if node.children]
+        tasks = [
+            (node.polygon, [child.polygon for child in node.children])
+            for node in nodes
+        ]
+        # interleaved chunks, the large segments are close to the root
+        num_chunks = MISSING_CHILDREN_CHUNKS
+        chunks = [tasks[i::num_chunks] for i in range(num_chunks)]
+        results = [None] * len(tasks)
+
+        def reportProgress(num_done):
+            if progress is not None:
+                progress(
+                    "Filling gaps between segments ({}/{})".format(
+                        num_done, num_chunks
+                    )
+                )
+
+        if executor is None:
+            for i, chunk in enumerate(chunks):
+                reportProgress(i)
+                results[i::num_chunks] = findMissingPolygonsOfNodes(chunk)
+        else:
+            futures = {
+                executor.submit(findMissingPolygonsOfNodes, chunk): i
+                for i, chunk in enumerate(chunks)
+            }
+            try:
+                reportProgress(0)
+                for num_done, future in enumerate(
+                    concurrent.futures.as_completed(futures)
+                ):
+                    results[futures[future] :: num_chunks] = future.result()
+                    reportProgress(num_done + 1)
+            finally:
+                for future in futures:
+                    future.cancel()
+        return [
+            (node, polygons)
+            for node, polygons in zip(nodes, results)
+            if polygons
+        ]
+
+    def addMissingChildren(self, missing):
+        for node, polygons in missing:
+            for polygon in polygons:
+                node.children.append(
+                    SegmentationTree(
+                        list(polygon.exterior.coords),
+                        node.children[0].contrast_level,
+                    )
+                )
+            node.subtree_bbox = None
+        # the indices of the nodes changed
+        if self._cache is not None:
+            self._cache.resetContrastLevelIndex()
+            self._cache.raster = self._cache.raster_nodes = None
+
+    def createMissingChildren(self, executor=None, progress=None):
+        self.addMissingChildren(self.findMissingChildren(executor, progress))
 
     def selectedSegmentContainsPoint(self, point):
-        if self.polygon.contains(point):
-            if self.selected:
-                return True
-        
-            for child in self.children:
-                if child.selectedSegmentContainsPoint(point):
-                    return True
-        return False
\ No newline at end of file
+        return any(
+            node.selected
+            for node in self.preOrder(
+                lambda node: node.containsPoint(point.x, point.y)
+            )
+        )
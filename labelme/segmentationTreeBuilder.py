@@ -0,0 +1,310 @@
+import heapq
+import math
+
+import cv2
+import numpy as np
+
+
+# Approximate number of initial regions the image is split into before
+# hierarchical merging starts.
+NUM_INITIAL_REGIONS = 2000
+MIN_INITIAL_REGION_SIZE = 8
+
+
+def ignoreProgress(message):
+    pass
+
+
+def readImage(image_file):
+    """Decode an image given either its filename or its encoded bytes."""
+    if isinstance(image_file, bytes):
+        data = np.frombuffer(image_file, dtype=np.uint8)
+    else:
+        # np.fromfile + imdecode instead of imread so non-ascii paths work
+        data = np.fromfile(image_file, dtype=np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if image is None:
+        raise IOError("Cannot decode image")
+    return image
+
+
+def gridPositions(size, region_size):
+    """Returns the marker positions along an image side of ``size``.
+
+    The watershed overwrites the image border, markers are kept inside it
+    and at least one is seeded when the side has an interior.
+    """
+    if size < 3:
+        return np.zeros(0, dtype=np.int64)
+    positions = np.arange(region_size // 2, size - 1, region_size)
+    if not len(positions):
+        positions = np.array([size // 2])
+    return positions
+
+
+def overSegment(image, region_size):
+    """Split the image into compact regions following strong edges.
+
+    Markers are seeded on a regular grid and grown with a watershed, the
+    pixels the watershed leaves as boundaries are given to a neighbour.
+    Returns an int32 label image with labels in [0, num_labels).
+    """
+    height, width = image.shape[:2]
+    ys = gridPositions(height, region_size)
+    xs = gridPositions(width, region_size)
+    markers = np.zeros((height, width), dtype=np.int32)
+    grid_ys, grid_xs = np.meshgrid(ys, xs, indexing="ij")
+    markers[grid_ys, grid_xs] = np.arange(1, grid_ys.size + 1).reshape(
+        grid_ys.shape
+    )
+    cv2.watershed(image, markers)
+
+    labels = markers.astype(np.float32)
+    kernel = np.ones((3, 3), dtype=np.uint8)
+    unassigned = labels < 1
+    while unassigned.any():
+        dilated = cv2.dilate(labels, kernel)
+        labels[unassigned] = dilated[unassigned]
+        num_unassigned = np.count_nonzero(unassigned)
+        unassigned = labels < 1
+        if np.count_nonzero(unassigned) == num_unassigned:
+            # no marker survived, images too small to have an interior
+            labels[unassigned] = 1
+            break
+
+    # watershed can leave markers without pixels, relabel densely
+    _, labels = np.unique(labels.astype(np.int32), return_inverse=True)
+    return labels.reshape(height, width).astype(np.int32)
+
+
+def regionAdjacency(labels):
+    num_labels = int(labels.max()) + 1
+    pairs = []
+    for a, b in (
+        (labels[:, :-1], labels[:, 1:]),
+        (labels[:-1, :], labels[1:, :]),
+    ):
+        differ = a != b
+        a = a[differ].astype(np.int64)
+        b = b[differ].astype(np.int64)
+        pairs.append(np.minimum(a, b) * num_labels + np.maximum(a, b))
+    pairs = np.unique(np.concatenate(pairs))
+    return np.stack([pairs // num_labels, pairs % num_labels], axis=1)
+
+
+def mergeRegions(labels, image):
+    """Greedily merge the most similar neighbouring regions.
+
+    Returns the merge tree as ``(children, contrast, sizes)`` where leaves
+    are the initial labels and node ``num_labels + k`` is the result of the
+    k-th merge.  The contrast of a node is the colour distance at which it
+    was formed, clamped to be at least the contrast of its children.
+    """
+    num_labels = int(labels.max()) + 1
+    num_nodes = 2 * num_labels - 1
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB).reshape(-1, 3)
+    flat_labels = labels.ravel()
+
+    sizes = np.zeros(num_nodes, dtype=np.float64)
+    sizes[:num_labels] = np.bincount(flat_labels, minlength=num_labels)
+    sums = np.zeros((num_nodes, 3), dtype=np.float64)
+    for c in range(3):
+        sums[:num_labels, c] = np.bincount(
+            flat_labels,
+            weights=lab[:, c].astype(np.float64),
+            minlength=num_labels,
+        )
+    means = [None] * num_nodes
+    leaf_means = sums[:num_labels] / sizes[:num_labels, None]
+    means[:num_labels] = leaf_means.tolist()
+
+    neighbours = [set() for _ in range(num_nodes)]
+    heap = []
+    for a, b in regionAdjacency(labels).tolist():
+        neighbours[a].add(b)
+        neighbours[b].add(a)
+        heap.append((math.dist(means[a], means[b]), a, b))
+    heapq.heapify(heap)
+
+    children = [()] * num_nodes
+    contrast = np.zeros(num_nodes, dtype=np.int32)
+    active = np.zeros(num_nodes, dtype=bool)
+    active[:num_labels] = True
+    node = num_labels
+    while heap:
+        weight, a, b = heapq.heappop(heap)
+        if not (active[a] and active[b]):
+            continue
+        active[a] = active[b] = False
+        active[node] = True
+        children[node] = (a, b)
+        contrast[node] = max(int(round(weight)), contrast[a], contrast[b])
+        sizes[node] = sizes[a] + sizes[b]
+        sums[node] = sums[a] + sums[b]
+        means[node] = (sums[node] / sizes[node]).tolist()
+        neighbours[node] = (neighbours[a] | neighbours[b]) - {a, b}
+        for d in neighbours[node]:
+            neighbours[d].discard(a)
+            neighbours[d].discard(b)
+            neighbours[d].add(node)
+            heapq.heappush(heap, (math.dist(means[node], means[d]), node, d))
+        neighbours[a] = neighbours[b] = None
+        node += 1
+
+    return children[:node], contrast[:node], sizes[:node].astype(np.int64)
+
+
+def collapseMergeTree(children, contrast, num_labels):
+    """Fold chains of merges at the same contrast into a single node."""
+    collapsed = [list(c) for c in children]
+    kept = np.ones(len(children), dtype=bool)
+    for node in range(num_labels, len(children)):
+        node_children = []
+        for child in collapsed[node]:
+            if child >= num_labels and contrast[child] == contrast[node]:
+                node_children += collapsed[child]
+                kept[child] = False
+            else:
+                node_children.append(child)
+        collapsed[node] = node_children
+    return collapsed, kept
+
+
+def createRegionList(image_file, progress=None):
+    """Build a hierarchical segmentation of an image file or encoded bytes.
+
+    Returns the same ``(regions, num_regions)`` as ``ReadRegionList`` where
+    each region is ``[size, contrast_level, boundary, parent]``, boundary is
+    an ``(N, 2)`` array of the ``[x, y]`` points of the region outline and
+    parent is the index of the enclosing region.  Regions are ordered from
+    the root (whole image) down, so parents always come before children.
+
+    ``progress`` is called with a status message as the work advances, it
+    may raise to abort the segmentation.
+    """
+    if progress is None:
+        progress = ignoreProgress
+
+    progress("Decoding image")
+    image = readImage(image_file)
+    height, width = image.shape[:2]
+
+    region_size = int(
+        max(
+            MIN_INITIAL_REGION_SIZE,
+            np.sqrt(height * width / NUM_INITIAL_REGIONS),
+        )
+    )
+    progress("Over-segmenting image")
+    labels = overSegment(cv2.GaussianBlur(image, (5, 5), 0), region_size)
+    num_labels = int(labels.max()) + 1
+    progress("Merging regions")
+    children, contrast, sizes = mergeRegions(labels, image)
+    children, kept = collapseMergeTree(children, contrast, num_labels)
+    num_nodes = len(children)
+
+    # bounding boxes as [x0, y0, x1, y1) of every node
+    bboxes = np.empty((num_nodes, 4), dtype=np.int64)
+    ys, xs = np.indices(labels.shape)
+    flat_labels = labels.ravel()
+    bboxes[:num_labels, :2] = np.iinfo(np.int64).max
+    bboxes[:num_labels, 2:] = -1
+    np.minimum.at(bboxes[:, 0], flat_labels, xs.ravel())
+    np.minimum.at(bboxes[:, 1], flat_labels, ys.ravel())
+    np.maximum.at(bboxes[:, 2], flat_labels, xs.ravel() + 1)
+    np.maximum.at(bboxes[:, 3], flat_labels, ys.ravel() + 1)
+
+    # walk the merge tree bottom-up, so that each leaf is owned by the node
+    # currently being traced
+    owner = np.arange(num_labels, dtype=np.int64)
+    leaves = [np.array([i]) for i in range(num_labels)]
+    leaves += [None] * (num_nodes - num_labels)
+    boundaries = [None] * num_nodes
+    for node in range(num_nodes):
+        if not kept[node]:
+            continue
+        if node % 1000 == 0:
+            progress("Tracing regions ({}%)".format(100 * node // num_nodes))
+        if node >= num_labels:
+            node_children = children[node]
+            leaves[node] = np.concatenate([leaves[c] for c in node_children])
+            bboxes[node, :2] = bboxes[node_children, :2].min(axis=0)
+            bboxes[node, 2:] = bboxes[node_children, 2:].max(axis=0)
+            for c in node_children:
+                leaves[c] = None
+            owner[leaves[node]] = node
+        x0, y0, x1, y1 = bboxes[node]
+        mask = (owner[labels[y0:y1, x0:x1]] == node).astype(np.uint8)
+        contours, _ = cv2.findContours(
+            mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+        )
+        contour = max(contours, key=len).reshape(-1, 2)
+        boundaries[node] = contour + np.array([x0, y0], dtype=np.int32)
+
+    order = np.flatnonzero(kept)[::-1]
+    # output index of the merge that absorbed each node, -1 for the root
+    parents = np.full(num_nodes, -1, dtype=np.int64)
+    region_indices = np.full(num_nodes, -1, dtype=np.int64)
+    region_indices[order] = np.arange(len(order))
+    for node in order.tolist():
+        if node >= num_labels:
+            parents[children[node]] = region_indices[node]
+    boundaries = [boundaries[node] for node in order]
+    return makeRegionList(
+        np.array([len(b) for b in boundaries], dtype=np.int64),
+        sizes[order],
+        contrast[order],
+        np.concatenate(boundaries).astype(np.int32, copy=False),
+        parents[order],
+    )
+
+
+def makeRegionList(
+    num_boundary_points, sizes, contrast_levels, boundary_points, parents=None
+):
+    """Split a flat ``(N, 2)`` array of ``[x, y]`` points into regions.
+
+    Each region gets a view into ``boundary_points``, no coordinates are
+    copied.  The parent of a region is the index of the region it was
+    merged into, -1 for roots, or None when it is not known.
+    """
+    ends = np.cumsum(num_boundary_points)
+    starts = ends - num_boundary_points
+    if parents is None:
+        parents = [None] * len(sizes)
+    else:
+        parents = parents.tolist()
+    regions = [
+        [size, contrast_level, boundary_points[start:end], parent]
+        for size, contrast_level, start, end, parent in zip(
+            sizes.tolist(),
+            contrast_levels.tolist(),
+            starts.tolist(),
+            ends.tolist(),
+            parents,
+        )
+    ]
+    return regions, len(regions)
+
+
+def writeRegionList(regions, generalDataDir, boundaryDataDir):
+    """Write regions in the format of the segmentation_tree binary.
+
+    When the parents of the regions are known, they are stored as a fourth
+    field after the ``[num_boundary_points, size, contrast_level]`` of
+    each region.
+    """
+    fields = [
+        [len(boundary), size, contrast]
+        for size, contrast, boundary, _ in regions
+    ]
+    if all(parent is not None for _, _, _, parent in regions):
+        for field, region in zip(fields, regions):
+            field.append(region[3])
+    general_data = np.array(fields, dtype=np.int32).ravel()
+    np.concatenate([[len(regions)], general_data]).astype(np.int32).tofile(
+        generalDataDir
+    )
+    # boundary points are stored as (row, column)
+    boundary_data = np.concatenate([region[2] for region in regions])
+    boundary_data[:, ::-1].astype(np.int32).tofile(boundaryDataDir)
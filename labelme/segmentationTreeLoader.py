@@ -0,0 +1,374 @@
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import os.path as osp
+import threading
+
+import numpy as np
+from qtpy import QtCore
+
+from labelme.logger import logger
+from labelme import segmentationTree
+from labelme.flatSegmentationTree import FlatSegmentationTree
+from labelme.segmentationTree import SegmentationTree
+from labelme.segmentationTreeBuilder import ignoreProgress
+
+
+class SegTreeLoadCancelled(Exception):
+    pass
+
+
+SEG_TREE_MAGIC = b"LMSEGTR2"
+# magic followed by int64 [num_contrast_levels, num_nodes, num_coords]
+SEG_TREE_HEADER_SIZE = len(SEG_TREE_MAGIC) + 3 * 8
+# dtype of the coordinates per magic, the first version stored float64
+SEG_TREE_COORDS_DTYPES = {
+    b"LMSEGTR1": np.float64,
+    SEG_TREE_MAGIC: np.float32,
+}
+
+
+def getSegTreeFilename(filename):
+    return osp.splitext(filename)[0] + "_seg_tree" + ".bin"
+
+
+def getSegTreeRasterFilename(seg_tree_filename):
+    return osp.splitext(seg_tree_filename)[0] + "_raster" + ".npy"
+
+
+def getJSONSegTreeFilename(seg_tree_filename):
+    return osp.splitext(seg_tree_filename)[0] + ".json"
+
+
+def readSegTreeMagic(seg_tree_filename):
+    with open(seg_tree_filename, "rb") as f:
+        return f.read(len(SEG_TREE_MAGIC))
+
+
+def isBinarySegTreeFile(seg_tree_filename):
+    return readSegTreeMagic(seg_tree_filename) in SEG_TREE_COORDS_DTYPES
+
+
+def readSegTreeFile(seg_tree_filename, flat=False):
+    """Read a binary or JSON segmentation tree file.
+
+    With ``flat`` the tree is returned as a FlatSegmentationTree.
+    """
+    if isBinarySegTreeFile(seg_tree_filename):
+        return readBinarySegTreeFile(seg_tree_filename, flat)
+    with open(seg_tree_filename, "r") as f:
+        jsonSegTree = json.loads(f.read())
+    seg_tree = SegmentationTree()
+    contrast_levels = seg_tree.loadSegTreeFromDictArray(jsonSegTree)
+    if flat:
+        return FlatSegmentationTree.fromSegTree(seg_tree, contrast_levels)
+    return seg_tree, contrast_levels
+
+
+def readBinarySegTreeFile(seg_tree_filename, flat=False):
+    num_contrast_levels, num_nodes, num_coords = np.fromfile(
+        seg_tree_filename,
+        dtype=np.int64,
+        count=3,
+        offset=len(SEG_TREE_MAGIC),
+    ).tolist()
+    offset = SEG_TREE_HEADER_SIZE
+    arrays = []
+    for dtype, shape in [
+        (np.int32, (num_contrast_levels,)),
+        (np.int32, (num_nodes, 3)),
+        (
+            SEG_TREE_COORDS_DTYPES[readSegTreeMagic(seg_tree_filename)],
+            (num_coords, 2),
+        ),
+    ]:
+        # arrays start on 8 byte boundaries
+        offset += -offset % 8
+        if np.prod(shape) == 0:
+            arrays.append(np.zeros(shape, dtype=dtype))
+            continue
+        arrays.append(
+            np.memmap(
+                seg_tree_filename,
+                dtype=dtype,
+                mode="r",
+                offset=offset,
+                shape=shape,
+            )
+        )
+        offset += np.dtype(dtype).itemsize * np.prod(shape)
+    if flat:
+        return FlatSegmentationTree.fromArrays(*arrays)
+    seg_tree = SegmentationTree()
+    contrast_levels = seg_tree.loadSegTreeFromArrays(*arrays)
+    return seg_tree, contrast_levels
+
+
+def writeSegTreeFile(seg_tree_filename, seg_tree, contrast_levels):
+    """Write the segmentation tree in the binary format.
+
+    The file is a header followed by the contrast levels, the
+    ``[num_coords, num_children, contrast_level]`` of every node in
+    pre-order and the coordinates of all the nodes, so that it can be
+    memory mapped.
+    """
+    arrays = seg_tree.getSegTreeAsArrays(contrast_levels)
+    # write to a temporary file first so that an interrupted write never
+    # leaves a truncated cache behind
+    tmp_filename = seg_tree_filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(SEG_TREE_MAGIC)
+        f.write(np.array([len(a) for a in arrays], dtype=np.int64).tobytes())
+        for array in arrays:
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_filename, seg_tree_filename)
+
+
+def convertSegTreeFile(json_filename, seg_tree_filename=None):
+    """Upgrade a JSON segmentation tree cache to the binary format."""
+    if seg_tree_filename is None:
+        seg_tree_filename = osp.splitext(json_filename)[0] + ".bin"
+    seg_tree, contrast_levels = readSegTreeFile(json_filename)
+    writeSegTreeFile(seg_tree_filename, seg_tree, contrast_levels)
+    return seg_tree, contrast_levels
+
+
+def loadSegTree(seg_tree_filename, image_data, progress=None, flat=False):
+    """Read the cached segmentation tree, or build and cache it.
+
+    Returns ``(seg_tree, contrast_levels)``, or ``(None, None)`` when there
+    is neither a cache nor image data to build from.  With ``flat`` the
+    tree is returned as a FlatSegmentationTree.
+    """
+    if progress is None:
+        progress = ignoreProgress
+
+    if osp.exists(seg_tree_filename):
+        progress("Reading segmentation tree")
+        try:
+            return readSegTreeFile(seg_tree_filename, flat)
+        except (IOError, ValueError):
+            logger.error(
+                "Error loading segmentation tree: {}".format(seg_tree_filename)
+            )
+    # caches written before the binary format
+    json_filename = getJSONSegTreeFilename(seg_tree_filename)
+    if osp.exists(json_filename):
+        progress("Reading segmentation tree")
+        try:
+            seg_tree, contrast_levels = readSegTreeFile(json_filename, flat)
+        except (IOError, ValueError):
+            logger.error(
+                "Error loading segmentation tree JSON: {}".format(
+                    json_filename
+                )
+            )
+        else:
+            saveSegTree(seg_tree_filename, seg_tree, contrast_levels)
+            return seg_tree, contrast_levels
+    if not image_data:
+        return None, None
+
+    seg_tree, contrast_levels = segmentationTree.createSegTree(
+        image_data, progress
+    )
+    completeSegTree(seg_tree_filename, seg_tree, contrast_levels, progress)
+    if flat:
+        return FlatSegmentationTree.fromSegTree(seg_tree, contrast_levels)
+    return seg_tree, contrast_levels
+
+
+def hasCachedSegTree(seg_tree_filename):
+    return osp.exists(seg_tree_filename) or osp.exists(
+        getJSONSegTreeFilename(seg_tree_filename)
+    )
+
+
+def completeSegTree(seg_tree_filename, seg_tree, contrast_levels, progress):
+    """Fill the gaps between the segments of a new tree and cache it."""
+    seg_tree.createMissingChildren(getProcessPool(), progress)
+    progress("Saving segmentation tree")
+    saveSegTree(seg_tree_filename, seg_tree, contrast_levels)
+
+
+_process_pool = None
+
+
+def getProcessPool():
+    """Returns the process pool shared by the loaders, None on one CPU."""
+    global _process_pool
+    if _process_pool is None and (os.cpu_count() or 1) > 1:
+        # spawned workers, forking a process running Qt threads is unsafe
+        _process_pool = concurrent.futures.ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def shutdownProcessPool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def saveSegTree(seg_tree_filename, seg_tree, contrast_levels):
+    try:
+        writeSegTreeFile(seg_tree_filename, seg_tree, contrast_levels)
+    except IOError:
+        logger.error(
+            "Error saving segmentation tree: {}".format(seg_tree_filename)
+        )
+
+
+def loadSegTreeRaster(seg_tree, seg_tree_filename):
+    """Read the cached raster of the tree, or build and cache it.
+
+    The raster is given to the tree once it is ready, so this can run in
+    a background thread while the tree is in use.
+    """
+    raster_filename = getSegTreeRasterFilename(seg_tree_filename)
+    raster = None
+    if (
+        osp.exists(raster_filename)
+        and osp.exists(seg_tree_filename)
+        and osp.getmtime(raster_filename) >= osp.getmtime(seg_tree_filename)
+    ):
+        try:
+            raster = seg_tree.loadRaster(raster_filename)
+        except (IOError, ValueError):
+            logger.error(
+                "Error loading segmentation tree raster: {}".format(
+                    raster_filename
+                )
+            )
+    if raster is None:
+        raster = seg_tree.buildRaster()
+        try:
+            raster.save(raster_filename)
+        except IOError:
+            logger.error(
+                "Error saving segmentation tree raster: {}".format(
+                    raster_filename
+                )
+            )
+    if raster.topology is None:
+        raster.buildTopology()
+    seg_tree.setRaster(raster)
+    return raster
+
+
+def saveSegTreeAndLoadRaster(seg_tree, seg_tree_filename, contrast_levels):
+    # the raster cache is only used when it is newer than the tree
+    saveSegTree(seg_tree_filename, seg_tree, contrast_levels)
+    return loadSegTreeRaster(seg_tree, seg_tree_filename)
+
+
+def startLoadingSegTreeRaster(
+    seg_tree, seg_tree_filename, contrast_levels=None
+):
+    """Load the raster in a background thread, with ``contrast_levels`` the
+    tree is saved first."""
+    if contrast_levels is None:
+        target = loadSegTreeRaster
+        args = (seg_tree, seg_tree_filename)
+    else:
+        target = saveSegTreeAndLoadRaster
+        args = (seg_tree, seg_tree_filename, contrast_levels)
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+class SegTreeLoader(QtCore.QThread):
+    """Load or build the segmentation tree of an image off the UI thread."""
+
+    progress = QtCore.Signal(str)
+    # a new tree usable before the gaps between its segments are filled,
+    # it is emitted again with loaded once they are found, the receiver
+    # adds missing_children to the tree and saves it
+    built = QtCore.Signal(object, object)
+    loaded = QtCore.Signal(object, object)
+    failed = QtCore.Signal(str)
+
+    def __init__(
+        self,
+        seg_tree_filename,
+        image_data,
+        parent=None,
+        pending=None,
+        flat=False,
+    ):
+        super(SegTreeLoader, self).__init__(parent)
+        self.seg_tree_filename = seg_tree_filename
+        self.image_data = image_data
+        self.flat = flat
+        # future of a prefetch already building the same tree
+        self.pending = pending
+        # for a tree built by the loader, the children to add to its nodes
+        self.missing_children = None
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def isCancelled(self):
+        return self._cancelled
+
+    def reportProgress(self, message):
+        if self._cancelled:
+            raise SegTreeLoadCancelled
+        self.progress.emit(message)
+
+    def waitForPending(self):
+        self.reportProgress("Building segmentation tree")
+        while not concurrent.futures.wait([self.pending], timeout=0.1)[0]:
+            if self._cancelled:
+                raise SegTreeLoadCancelled
+        if self.pending.cancelled() or self.pending.exception() is not None:
+            return None
+        return self.pending.result()
+
+    def buildSegTree(self):
+        seg_tree, contrast_levels = segmentationTree.createSegTree(
+            self.image_data, self.reportProgress
+        )
+        self.built.emit(seg_tree, contrast_levels)
+        # the tree is in use from now on, only read it here
+        self.missing_children = seg_tree.findMissingChildren(
+            getProcessPool(), self.reportProgress
+        )
+        return seg_tree, contrast_levels
+
+    def run(self):
+        try:
+            result = None
+            if self.pending is not None:
+                result = self.waitForPending()
+            if (
+                result is None
+                and not self.flat
+                and self.image_data
+                and not hasCachedSegTree(self.seg_tree_filename)
+            ):
+                result = self.buildSegTree()
+            if result is None:
+                result = loadSegTree(
+                    self.seg_tree_filename,
+                    self.image_data,
+                    self.reportProgress,
+                    self.flat,
+                )
+            seg_tree, contrast_levels = result
+        except SegTreeLoadCancelled:
+            return
+        except Exception as e:
+            logger.error(
+                "Error creating segmentation tree from image: {}".format(e)
+            )
+            self.failed.emit(str(e))
+            return
+        if not self._cancelled:
+            self.loaded.emit(seg_tree, contrast_levels)
@@ -0,0 +1,103 @@
+import os
+
+import cv2
+import numpy as np
+
+from labelme.segmentationTreeTopology import SegTreeTopology
+
+
+# sub-pixel bits of the polygon coordinates given to cv2.fillPoly
+FILL_SHIFT = 4
+
+
+class SegTreeRaster(object):
+    """Pixel lookup of the segments of a segmentation tree.
+
+    Nodes are identified by their pre-order index.  The leaf raster holds,
+    for every pixel, ``index + 1`` of the smallest node covering it (0 where
+    there is none), the other nodes covering it are ancestors of that one.
+    """
+
+    def __init__(self, leaf, parents):
+        self.leaf = leaf
+        self.parents = np.asarray(parents, dtype=np.int64)
+        self.topology = None
+
+    @classmethod
+    def build(cls, coords, parents, areas, width, height):
+        """Rasterize the nodes, largest first.
+
+        Only the outlines of the segments are kept, so a segment surrounding
+        a sibling covers it as well; drawing by decreasing area leaves every
+        pixel to the innermost one.  Parents are drawn before children of
+        the same area.
+        """
+        leaf = np.zeros((height, width), dtype=np.int32)
+        order = np.lexsort((np.arange(len(coords)), -np.asarray(areas)))
+        for index in order.tolist():
+            node_coords = coords[index]
+            if len(node_coords) < 3:
+                continue
+            pts = np.round(np.asarray(node_coords) * (1 << FILL_SHIFT))
+            cv2.fillPoly(
+                leaf,
+                [pts.astype(np.int32)],
+                index + 1,
+                lineType=cv2.LINE_8,
+                shift=FILL_SHIFT,
+            )
+        return cls(leaf.view(np.uint32), parents)
+
+    @classmethod
+    def load(cls, filename, parents):
+        leaf = np.load(filename, mmap_mode="r")
+        if leaf.dtype != np.uint32 or leaf.ndim != 2:
+            raise ValueError("Invalid segmentation tree raster")
+        if leaf.size and int(leaf.max()) > len(parents):
+            raise ValueError("Segmentation tree raster of another tree")
+        return cls(leaf, parents)
+
+    def save(self, filename):
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            np.save(f, np.asarray(self.leaf))
+        os.replace(tmp_filename, filename)
+
+    def _pixel(self, x, y):
+        col, row = int(np.floor(x + 0.5)), int(np.floor(y + 0.5))
+        height, width = self.leaf.shape
+        if not (0 <= row < height and 0 <= col < width):
+            return None
+        return row, col
+
+    def leafAt(self, x, y):
+        """Returns the index of the deepest node at the point, or -1."""
+        pixel = self._pixel(x, y)
+        if pixel is None:
+            return -1
+        return int(self.leaf[pixel]) - 1
+
+    def buildTopology(self):
+        self.topology = SegTreeTopology.fromLabels(self.leaf)
+        return self.topology
+
+    def getCoveredPixels(self, selected):
+        """Tells for every leaf raster value if a selected node covers it.
+
+        ``selected`` is indexed by node, a node covers the pixels of all
+        the nodes of its subtree.
+        """
+        covered = np.zeros(len(self.parents) + 1, dtype=bool)
+        selected = np.asarray(selected, dtype=bool).tolist()
+        for i, parent in enumerate(self.parents.tolist()):
+            covered[i + 1] = selected[i] or covered[parent + 1]
+        return covered
+
+    def getSelectionUnion(self, selected):
+        """Returns the outline of the pixels covered by selected nodes."""
+        return self.topology.getUnion(self.getCoveredPixels(selected))
+
+    def ancestors(self, index):
+        while index >= 0:
+            yield index
+            index = self.parents[index]
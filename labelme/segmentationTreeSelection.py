@@ -0,0 +1,62 @@
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+
+# distance the selected segments are grown by so that neighbours merge
+SELECTION_BUFFER = 0.5
+
+
+def bufferSegment(polygon):
+    return shapely.buffer(polygon, SELECTION_BUFFER, quad_segs=16)
+
+
+class SelectionUnion(object):
+    """Union of the buffered selected segments, updated incrementally.
+
+    Segments are identified by any hashable key and ``buffered(key)``
+    returns their cached buffered geometry.  Each update only unions the
+    segments that were selected since the previous one, and for the
+    deselected ones only redoes the union where they were.
+    """
+
+    def __init__(self):
+        self.selected = set()
+        self.union = Polygon()
+
+    def clear(self):
+        self.selected = set()
+        self.union = Polygon()
+
+    def update(self, selected, buffered):
+        selected = set(selected)
+        added = selected - self.selected
+        removed = self.selected - selected
+        kept = self.selected & selected
+
+        if len(removed) > len(kept):
+            # cheaper to start over
+            self.selected = set()
+            self.union = Polygon()
+            added = selected
+        elif removed:
+            removed_area = shapely.union_all([buffered(k) for k in removed])
+            shapely.prepare(removed_area)
+            kept = list(kept)
+            kept_geometries = np.array(
+                [buffered(k) for k in kept], dtype=object
+            )
+            # the kept segments overlapping the removed ones cover part of
+            # their area again
+            covering = kept_geometries[
+                shapely.intersects(removed_area, kept_geometries)
+            ]
+            self.union = shapely.union_all(
+                [shapely.difference(self.union, removed_area)] + list(covering)
+            )
+        if added:
+            self.union = shapely.union_all(
+                [self.union] + [buffered(k) for k in added]
+            )
+        self.selected = selected
+        return self.union
@@ -0,0 +1,227 @@
+import numpy as np
+import shapely
+
+
+class SegTreeTopology(object):
+    """Boundaries between the regions of a label raster as shared arcs.
+
+    Every boundary between two labels is stored once, as an arc running
+    along the pixel edges with one label on its left and the other on its
+    right.  The outline of a set of labels is made of the arcs separating
+    a label of the set from one outside of it, so the union of segments is
+    an arc selection followed by chaining the arcs into rings.  Outlines
+    follow pixel edges, they are exact and gap free.
+
+    Coordinates are pixel corners shifted by half a pixel so that they
+    match the pixel centered outlines of the tree nodes.
+    """
+
+    def __init__(self, coords, offsets, left, right):
+        self.coords = coords
+        self.offsets = offsets
+        self.left = left
+        self.right = right
+
+    def __len__(self):
+        return len(self.left)
+
+    @classmethod
+    def fromLabels(cls, labels):
+        labels = np.pad(np.asarray(labels).astype(np.int64), 1)
+        height, width = labels.shape[0] - 2, labels.shape[1] - 2
+        # edge (x, y) -> (x, y + 1) between pixels (y, x - 1) and (y, x),
+        # the one to the east is on its left
+        vertical = labels[1:-1, :-1] != labels[1:-1, 1:]
+        # edge (x, y) -> (x + 1, y) between pixels (y - 1, x) and (y, x),
+        # the one to the north is on its left
+        horizontal = labels[:-1, 1:-1] != labels[1:, 1:-1]
+
+        vy, vx = np.nonzero(vertical)
+        hy, hx = np.nonzero(horizontal)
+        # vertices are pixel corners numbered y * (width + 1) + x
+        stride = width + 1
+        starts = np.concatenate([vy * stride + vx, hy * stride + hx])
+        ends = np.concatenate([(vy + 1) * stride + vx, hy * stride + hx + 1])
+        edge_left = np.concatenate(
+            [labels[vy + 1, vx + 1], labels[hy, hx + 1]]
+        )
+        edge_right = np.concatenate(
+            [labels[vy + 1, vx], labels[hy + 1, hx + 1]]
+        )
+
+        # edges around every vertex, vertices of degree 2 continue an arc
+        degree = np.bincount(
+            np.concatenate([starts, ends]),
+            minlength=(height + 1) * stride,
+        )
+        endpoints = np.concatenate([starts, ends])
+        incident = np.argsort(endpoints, kind="stable") % len(starts)
+        first_incident = np.concatenate([[0], np.cumsum(degree)])
+
+        starts, ends = starts.tolist(), ends.tolist()
+        degree = degree.tolist()
+        incident = incident.tolist()
+        first_incident = first_incident.tolist()
+        visited = [False] * len(starts)
+
+        arc_vertices = []
+        arc_left = []
+        arc_right = []
+
+        def traceArc(vertex, edge):
+            vertices = [vertex]
+            forward = starts[edge] == vertex
+            if forward:
+                arc_left.append(edge_left[edge])
+                arc_right.append(edge_right[edge])
+            else:
+                arc_left.append(edge_right[edge])
+                arc_right.append(edge_left[edge])
+            while True:
+                visited[edge] = True
+                vertex = ends[edge] if starts[edge] == vertex else starts[edge]
+                vertices.append(vertex)
+                if degree[vertex] != 2:
+                    break
+                i = first_incident[vertex]
+                edge = incident[i] if incident[i] != edge else incident[i + 1]
+                if visited[edge]:
+                    # back to the start of a closed boundary
+                    break
+            arc_vertices.append(vertices)
+
+        # arcs between junctions, then the closed boundaries without any
+        for vertex in np.flatnonzero(np.asarray(degree) > 2).tolist():
+            for i in range(first_incident[vertex], first_incident[vertex + 1]):
+                if not visited[incident[i]]:
+                    traceArc(vertex, incident[i])
+        for edge in range(len(starts)):
+            if not visited[edge]:
+                traceArc(starts[edge], edge)
+
+        # keep the corners of the arcs only
+        coords = []
+        offsets = [0]
+        for vertices in arc_vertices:
+            vertices = np.asarray(vertices)
+            points = np.stack([vertices % stride, vertices // stride], axis=1)
+            if len(points) > 2:
+                direction = np.diff(points, axis=0)
+                turns = np.any(direction[1:] != direction[:-1], axis=1)
+                points = points[np.concatenate([[True], turns, [True]])]
+            coords.append(points)
+            offsets.append(offsets[-1] + len(points))
+        if coords:
+            coords = np.concatenate(coords).astype(np.float64) - 0.5
+        else:
+            coords = np.zeros((0, 2))
+        return cls(
+            coords,
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(arc_left, dtype=np.int64),
+            np.asarray(arc_right, dtype=np.int64),
+        )
+
+    def getArc(self, index, reverse=False):
+        arc = self.coords[self.offsets[index] : self.offsets[index + 1]]
+        return arc[::-1] if reverse else arc
+
+    def getBoundaryArcs(self, inside):
+        """Returns the arcs around the labels with ``inside`` set.
+
+        ``inside`` is a boolean array indexed by label, the second array
+        tells which arcs have to be reversed to have the inside on their
+        left.
+        """
+        inside = np.asarray(inside, dtype=bool)
+        arcs = np.flatnonzero(inside[self.left] != inside[self.right])
+        return arcs, ~inside[self.left[arcs]]
+
+    def getRings(self, inside):
+        arcs, reverse = self.getBoundaryArcs(inside)
+        pieces = [
+            self.getArc(arc, rev)
+            for arc, rev in zip(arcs.tolist(), reverse.tolist())
+        ]
+        first = [tuple(piece[0]) for piece in pieces]
+        last = [tuple(piece[-1]) for piece in pieces]
+        first_direction = [
+            tuple(np.sign(piece[1] - piece[0])) for piece in pieces
+        ]
+        last_direction = [
+            tuple(np.sign(piece[-1] - piece[-2])) for piece in pieces
+        ]
+        outgoing = {}
+        for i, point in enumerate(first):
+            outgoing.setdefault(point, []).append(i)
+
+        used = [False] * len(pieces)
+        rings = []
+        for start in range(len(pieces)):
+            if used[start]:
+                continue
+            ring = []
+            piece = start
+            while True:
+                used[piece] = True
+                ring.append(pieces[piece][:-1])
+                dx, dy = last_direction[piece]
+                # turn left first, this keeps the inside on the left
+                # hugging a single pixel where two diagonal pixels meet
+                turns = [(dy, -dx), (dx, dy), (-dy, dx)]
+                candidates = [
+                    i
+                    for i in outgoing[last[piece]]
+                    if not used[i] or i == start
+                ]
+                piece = min(
+                    candidates,
+                    key=lambda i: turns.index(first_direction[i])
+                    if first_direction[i] in turns
+                    else len(turns),
+                )
+                if piece == start:
+                    break
+            ring = np.concatenate(ring)
+            rings.append(np.concatenate([ring, ring[:1]]))
+        return rings
+
+    def getUnion(self, inside):
+        """Returns the outline of the labels with ``inside`` set."""
+        exteriors = []
+        holes = []
+        for ring in self.getRings(inside):
+            x, y = ring[:, 0], ring[:, 1]
+            signed_area = np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])
+            # with the inside on the left, exteriors run counterclockwise
+            # on screen, which is a negative area as y points down
+            (exteriors if signed_area < 0 else holes).append(ring)
+        if not exteriors:
+            return shapely.Polygon()
+
+        shells = [shapely.Polygon(ring) for ring in exteriors]
+        shell_holes = [[] for _ in exteriors]
+        if holes:
+            # every hole goes to the smallest exterior covering it
+            hole_polygons = [shapely.Polygon(ring) for ring in holes]
+            tree = shapely.STRtree(shells)
+            hole_index, shell_index = tree.query(
+                hole_polygons, predicate="covered_by"
+            )
+            areas = shapely.area(np.asarray(shells))
+            best = {}
+            for h, s in zip(hole_index.tolist(), shell_index.tolist()):
+                if h not in best or areas[s] < areas[best[h]]:
+                    best[h] = s
+            for h, s in best.items():
+                shell_holes[s].append(holes[h])
+        polygons = [
+            shapely.Polygon(shell, shell_hole)
+            for shell, shell_hole in zip(exteriors, shell_holes)
+        ]
+        if not all(polygon.is_valid for polygon in polygons):
+            # rings touching themselves where diagonal pixels meet
+            return shapely.union_all(shapely.make_valid(polygons))
+        if len(polygons) == 1:
+            return polygons[0]
+        return shapely.MultiPolygon(polygons)
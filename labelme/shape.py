@@ -1,15 +1,11 @@
 import copy
 import math
 
+import numpy as np
+import shapely
 from qtpy import QtCore
 from qtpy import QtGui
 
-import labelme.utils
-
-
-# TODO(unknown):
-# - [opt] Store paths instead of creating new ones at each paint.
-
 
 DEFAULT_LINE_COLOR = QtGui.QColor(0, 255, 0, 128)  # bf hovering
 DEFAULT_FILL_COLOR = QtGui.QColor(0, 255, 0, 128)  # hovering
@@ -43,6 +39,8 @@ class Shape(object):
     point_type = P_ROUND
     point_size = 8
     scale = 1.0
+    # below this scale shapes are drawn simplified
+    low_zoom_scale = 0.5
 
     def __init__(
         self,
@@ -54,6 +52,15 @@ class Shape(object):
     ):
         self.label = label
         self.group_id = group_id
+        # paths are built on demand and kept until the geometry changes
+        self._linePath = None
+        self._simplePaths = {}
+        self._vertexPath = None
+        self._vertexPathKey = None
+        self._path = None
+        self._boundingRect = None
+        self._coords = None
+        self._coordsRange = None
         self.points = []
         self.fill = False
         self.selected = False
@@ -78,6 +85,15 @@ class Shape(object):
 
         self.shape_type = shape_type
 
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, value):
+        self._points = value
+        self.invalidatePaths()
+
     @property
     def shape_type(self):
         return self._shape_type
@@ -98,42 +114,61 @@ class Shape(object):
         ]:
             raise ValueError("Unexpected shape_type: {}".format(value))
         self._shape_type = value
+        self.invalidatePaths()
+
+    def invalidatePaths(self):
+        """Drops the cached paths, to be called when the points change"""
+        self._linePath = None
+        self._simplePaths = {}
+        self._vertexPath = None
+        self._path = None
+        self._boundingRect = None
+        self._coords = None
+        self._coordsRange = None
 
     def close(self):
         self._closed = True
+        self._linePath = None
+        self._simplePaths = {}
 
     def addPoint(self, point):
         if self.points and point == self.points[0]:
             self.close()
         else:
             self.points.append(point)
+            self.invalidatePaths()
 
     def canAddPoint(self):
         return self.shape_type in ["polygon", "linestrip"]
 
     def popPoint(self):
         if self.points:
+            self.invalidatePaths()
             return self.points.pop()
         return None
 
     def insertPoint(self, i, point):
         self.points.insert(i, point)
+        self.invalidatePaths()
 
     def removePoint(self, i):
         self.points.pop(i)
+        self.invalidatePaths()
 
     def isClosed(self):
         return self._closed
 
     def setOpen(self):
         self._closed = False
+        self._linePath = None
+        self._simplePaths = {}
 
     def getRectFromLine(self, pt1, pt2):
         x1, y1 = pt1.x(), pt1.y()
         x2, y2 = pt2.x(), pt2.y()
         return QtCore.QRectF(x1, y1, x2 - x1, y2 - y1)
 
-    def paint(self, painter):
+    def paint(self, painter, vertices=True):
         if self.points:
             color = (
                 self.select_line_color if self.selected else self.line_color
@@ -143,51 +178,97 @@ class Shape(object):
             pen.setWidth(max(1, int(round(2.0 / self.scale))))
             painter.setPen(pen)
 
-            line_path = QtGui.QPainterPath()
-            vrtx_path = QtGui.QPainterPath()
+            line_path = self.getLinePath(self.getSimplifyTolerance())
+            painter.drawPath(line_path)
+            if vertices:
+                vrtx_path = self.getVertexPath()
+                painter.drawPath(vrtx_path)
+                painter.fillPath(vrtx_path, self._vertex_fill_color)
+            if self.fill:
+                color = (
+                    self.select_fill_color
+                    if self.selected
+                    else self.fill_color
+                )
+                painter.fillPath(line_path, color)
 
+    def getSimplifyTolerance(self):
+        """Returns how far, in image pixels, the drawn outline may stray
+        from the points at the current scale."""
+        if self.scale > self.low_zoom_scale or self.shape_type not in [
+            "polygon",
+            "linestrip",
+        ]:
+            return 0
+        # half a screen pixel, rounded down to a power of two so that
+        # zooming reuses the simplified paths
+        return 2 ** math.floor(math.log2(0.5 / self.scale))
+
+    def getLinePath(self, tolerance=0):
+        if tolerance > 0 and len(self.points) > 4:
+            return self.getSimplifiedLinePath(tolerance)
+        if self._linePath is None:
+            line_path = QtGui.QPainterPath()
             if self.shape_type == "rectangle":
                 assert len(self.points) in [1, 2]
                 if len(self.points) == 2:
                     rectangle = self.getRectFromLine(*self.points)
                     line_path.addRect(rectangle)
-                for i in range(len(self.points)):
-                    self.drawVertex(vrtx_path, i)
             elif self.shape_type == "circle":
                 assert len(self.points) in [1, 2]
                 if len(self.points) == 2:
                     rectangle = self.getCircleRectFromLine(self.points)
                     line_path.addEllipse(rectangle)
-                for i in range(len(self.points)):
-                    self.drawVertex(vrtx_path, i)
-            elif self.shape_type == "linestrip":
-                line_path.moveTo(self.points[0])
-                for i, p in enumerate(self.points):
-                    line_path.lineTo(p)
-                    self.drawVertex(vrtx_path, i)
             else:
                 line_path.moveTo(self.points[0])
-                # Uncommenting the following line will draw 2 paths
-                # for the 1st vertex, and make it non-filled, which
-                # may be desirable.
-                # self.drawVertex(vrtx_path, 0)
-
-                for i, p in enumerate(self.points):
+                for p in self.points:
                     line_path.lineTo(p)
-                    self.drawVertex(vrtx_path, i)
-                if self.isClosed():
+                if self.shape_type != "linestrip" and self.isClosed():
                     line_path.lineTo(self.points[0])
-
-            painter.drawPath(line_path)
-            painter.drawPath(vrtx_path)
-            painter.fillPath(vrtx_path, self._vertex_fill_color)
-            if self.fill:
-                color = (
-                    self.select_fill_color
-                    if self.selected
-                    else self.fill_color
+            self._linePath = line_path
+        return self._linePath
+
+    def getSimplifiedLinePath(self, tolerance):
+        if tolerance not in self._simplePaths:
+            coords = self.getCoords()
+            if self.shape_type != "linestrip" and self.isClosed():
+                coords = np.concatenate([coords, coords[:1]])
+            coords = shapely.get_coordinates(
+                shapely.simplify(
+                    shapely.linestrings(coords),
+                    tolerance,
+                    preserve_topology=False,
                 )
-                painter.fillPath(line_path, color)
+            )
+            line_path = QtGui.QPainterPath()
+            line_path.addPolygon(
+                QtGui.QPolygonF(
+                    [QtCore.QPointF(x, y) for x, y in coords.tolist()]
+                )
+            )
+            self._simplePaths[tolerance] = line_path
+        return self._simplePaths[tolerance]
+
+    def getVertexPath(self):
+        # vertex sizes depend on the scale and the highlighted vertex
+        key = (
+            self.scale,
+            self.point_size,
+            self.point_type,
+            self._highlightIndex,
+            self._highlightMode,
+        )
+        if self._vertexPath is None or self._vertexPathKey != key:
+            vrtx_path = QtGui.QPainterPath()
+            for i in range(len(self.points)):
+                self.drawVertex(vrtx_path, i)
+            self._vertexPath = vrtx_path
+            self._vertexPathKey = key
+        if self._highlightIndex is not None:
+            self._vertex_fill_color = self.hvertex_fill_color
+        else:
+            self._vertex_fill_color = self.vertex_fill_color
+        return self._vertexPath
 
     def drawVertex(self, path, i):
         d = self.point_size / self.scale
@@ -207,26 +288,60 @@ class Shape(object):
         else:
             assert False, "unsupported vertex shape"
 
+    def getCoords(self):
+        """Returns the points as an (N, 2) array"""
+        if self._coords is None:
+            self._coords = np.array(
+                [(p.x(), p.y()) for p in self.points], dtype=np.float64
+            ).reshape(-1, 2)
+            if len(self._coords):
+                self._coordsRange = (
+                    self._coords.min(axis=0),
+                    self._coords.max(axis=0),
+                )
+        return self._coords
+
+    def isNearPoints(self, point, epsilon):
+        # whether the point is within epsilon of the bbox of the points
+        if not len(self.getCoords()):
+            return False
+        (x0, y0), (x1, y1) = self._coordsRange
+        return (
+            x0 - epsilon <= point.x() <= x1 + epsilon
+            and y0 - epsilon <= point.y() <= y1 + epsilon
+        )
+
     def nearestVertex(self, point, epsilon):
-        min_distance = float("inf")
-        min_i = None
-        for i, p in enumerate(self.points):
-            dist = labelme.utils.distance(p - point)
-            if dist <= epsilon and dist < min_distance:
-                min_distance = dist
-                min_i = i
-        return min_i
+        if not self.isNearPoints(point, epsilon):
+            return None
+        coords = self.getCoords()
+        dist = np.hypot(coords[:, 0] - point.x(), coords[:, 1] - point.y())
+        i = int(np.argmin(dist))
+        if dist[i] <= epsilon:
+            return i
+        return None
 
     def nearestEdge(self, point, epsilon):
-        min_distance = float("inf")
-        post_i = None
-        for i in range(len(self.points)):
-            line = [self.points[i - 1], self.points[i]]
-            dist = labelme.utils.distancetoline(point, line)
-            if dist <= epsilon and dist < min_distance:
-                min_distance = dist
-                post_i = i
-        return post_i
+        if not self.isNearPoints(point, epsilon):
+            return None
+        # edge i goes from point i - 1 to point i
+        ends = self.getCoords()
+        starts = np.roll(ends, 1, axis=0)
+        direction = ends - starts
+        offset = np.array([point.x(), point.y()]) - starts
+        length2 = np.einsum("ij,ij->i", direction, direction)
+        t = np.einsum("ij,ij->i", offset, direction)
+        t = np.clip(
+            np.divide(t, length2, out=np.zeros_like(t), where=length2 > 0),
+            0,
+            1,
+        )
+        closest = offset - t[:, None] * direction
+        dist = np.hypot(closest[:, 0], closest[:, 1])
+        i = int(np.argmin(dist))
+        if dist[i] <= epsilon:
+            return i
+        return None
 
     def containsPoint(self, point):
         return self.makePath().contains(point)
@@ -242,6 +357,8 @@ class Shape(object):
         return rectangle
 
     def makePath(self):
+        if self._path is not None:
+            return self._path
         if self.shape_type == "rectangle":
             path = QtGui.QPainterPath()
             if len(self.points) == 2:
@@ -256,16 +373,20 @@ class Shape(object):
             path = QtGui.QPainterPath(self.points[0])
             for p in self.points[1:]:
                 path.lineTo(p)
+        self._path = path
         return path
 
     def boundingRect(self):
-        return self.makePath().boundingRect()
+        if self._boundingRect is None:
+            self._boundingRect = self.makePath().boundingRect()
+        return self._boundingRect
 
     def moveBy(self, offset):
         self.points = [p + offset for p in self.points]
 
     def moveVertexBy(self, i, offset):
         self.points[i] = self.points[i] + offset
+        self.invalidatePaths()
 
     def highlightVertex(self, i, action):
         """Highlight a vertex appropriately based on the current action
@@ -285,6 +406,21 @@ class Shape(object):
     def copy(self):
         return copy.deepcopy(self)
 
+    def __getstate__(self):
+        # Qt paths cannot be copied, the copy builds its own
+        state = self.__dict__.copy()
+        state.update(
+            _linePath=None,
+            _simplePaths={},
+            _vertexPath=None,
+            _vertexPathKey=None,
+            _path=None,
+            _boundingRect=None,
+            _coords=None,
+            _coordsRange=None,
+        )
+        return state
+
     def __len__(self):
         return len(self.points)
 
@@ -293,3 +429,4 @@ class Shape(object):
 
     def __setitem__(self, key, value):
         self.points[key] = value
+        self.invalidatePaths()
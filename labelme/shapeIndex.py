@@ -0,0 +1,134 @@
+import math
+
+
+class ShapeIndex(object):
+    """Grid of the shape bounding rects, to find the shapes near a point.
+
+    Shapes are looked up topmost first, that is in the reverse order of
+    the shape list like the canvas draws them.  The grid is rebuilt from
+    the list on the first lookup after ``invalidate``, shapes whose
+    geometry changed are moved with ``updateShape``.  Shapes spanning
+    more than ``max_cells`` cells are kept apart and checked one by one.
+    """
+
+    def __init__(self, cell_size=64, max_cells=64):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.shapes = []
+        self.cells = {}
+        self.large = set()
+        self.shape_cells = {}
+        self.bboxes = {}
+        self.order = {}
+        self.dirty = True
+
+    def setShapes(self, shapes):
+        self.shapes = shapes
+        self.invalidate()
+
+    def invalidate(self):
+        """To be called when shapes are added, removed or reordered"""
+        self.dirty = True
+
+    def rebuild(self):
+        self.cells = {}
+        self.large = set()
+        self.shape_cells = {}
+        self.bboxes = {}
+        self.order = {}
+        for i, shape in enumerate(self.shapes):
+            self.order[shape] = i
+            self.insert(shape)
+        self.dirty = False
+
+    def getCellRange(self, x0, y0, x1, y1):
+        size = self.cell_size
+        return (
+            math.floor(x0 / size),
+            math.floor(y0 / size),
+            math.floor(x1 / size),
+            math.floor(y1 / size),
+        )
+
+    def insert(self, shape):
+        if not shape.points:
+            return
+        rect = shape.boundingRect()
+        bbox = (rect.left(), rect.top(), rect.right(), rect.bottom())
+        self.bboxes[shape] = bbox
+        cx0, cy0, cx1, cy1 = self.getCellRange(*bbox)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > self.max_cells:
+            # a shape covering a large image would fill the grid
+            self.large.add(shape)
+            return
+        cells = [
+            (cx, cy)
+            for cx in range(cx0, cx1 + 1)
+            for cy in range(cy0, cy1 + 1)
+        ]
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(shape)
+        self.shape_cells[shape] = cells
+
+    def remove(self, shape):
+        self.large.discard(shape)
+        for cell in self.shape_cells.pop(shape, []):
+            self.cells[cell].discard(shape)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        self.bboxes.pop(shape, None)
+
+    def updateShape(self, shape):
+        """To be called when the points of a shape changed"""
+        if self.dirty or shape not in self.order:
+            return
+        self.remove(shape)
+        self.insert(shape)
+
+    def shapesIn(self, x0, y0, x1, y1):
+        """Returns the shapes whose bounding rect meets the rect, in the
+        order of the shape list."""
+        if self.dirty:
+            self.rebuild()
+        cx0, cy0, cx1, cy1 = self.getCellRange(x0, y0, x1, y1)
+        candidates = set(self.large)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            # zoomed out, most cells are in the rect
+            for (cx, cy), shapes in self.cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    candidates.update(shapes)
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    candidates.update(self.cells.get((cx, cy), ()))
+        shapes = []
+        for shape in candidates:
+            sx0, sy0, sx1, sy1 = self.bboxes[shape]
+            if sx0 <= x1 and x0 <= sx1 and sy0 <= y1 and y0 <= sy1:
+                shapes.append(shape)
+        shapes.sort(key=self.order.get)
+        return shapes
+
+    def shapesNear(self, point, margin=0):
+        """Returns the shapes whose bounding rect, grown by ``margin``,
+        holds the point, topmost first."""
+        if self.dirty:
+            self.rebuild()
+        x, y = point.x(), point.y()
+        cx0, cy0, cx1, cy1 = self.getCellRange(
+            x - margin, y - margin, x + margin, y + margin
+        )
+        candidates = set(self.large)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                candidates.update(self.cells.get((cx, cy), ()))
+        shapes = []
+        for shape in candidates:
+            x0, y0, x1, y1 = self.bboxes[shape]
+            if (
+                x0 - margin <= x <= x1 + margin
+                and y0 - margin <= y <= y1 + margin
+            ):
+                shapes.append(shape)
+        shapes.sort(key=self.order.get, reverse=True)
+        return shapes
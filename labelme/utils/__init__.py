@@ -25,3 +25,4 @@ from .qt import struct
 from .qt import distance
 from .qt import distancetoline
 from .qt import fmtShortcut
+from .qt import scanAllImages
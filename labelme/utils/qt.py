@@ -1,12 +1,16 @@
 from math import sqrt
+import os
 import os.path as osp
 
+import natsort
 import numpy as np
 
 from qtpy import QtCore
 from qtpy import QtGui
 from qtpy import QtWidgets
 
+from labelme.imagePyramid import getImagePyramidDirname
+
 
 here = osp.dirname(osp.abspath(__file__))
 
@@ -98,3 +102,22 @@ def distancetoline(point, line):
 def fmtShortcut(text):
     mod, key = text.split("+", 1)
     return "<b>%s</b>+<b>%s</b>" % (mod, key)
+
+
+def scanAllImages(folderPath):
+    extensions = [
+        ".%s" % fmt.data().decode().lower()
+        for fmt in QtGui.QImageReader.supportedImageFormats()
+    ]
+
+    images = []
+    for root, dirs, files in os.walk(folderPath):
+        files = [f for f in files if f.lower().endswith(tuple(extensions))]
+        # tiles cached next to the large images they were made from
+        tile_dirs = {getImagePyramidDirname(file) for file in files}
+        dirs[:] = [d for d in dirs if d not in tile_dirs]
+        for file in files:
+            relativePath = osp.join(root, file)
+            images.append(relativePath)
+    images = natsort.os_sorted(images)
+    return images
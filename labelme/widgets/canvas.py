@@ -4,6 +4,7 @@ from qtpy import QtWidgets
 
 from labelme import QT5
 from labelme.shape import Shape
+from labelme.shapeIndex import ShapeIndex
 import labelme.utils
 
 from shapely.geometry import Polygon, LineString, Point
@@ -72,6 +73,7 @@ class Canvas(QtWidgets.QWidget):
         super(Canvas, self).__init__(*args, **kwargs)
         # Initialise local state.
         self.mode = self.EDIT
+        self.shapeIndex = ShapeIndex()
         self.shapes = []
         self.shapesBackups = []
         self.current = None
@@ -88,6 +90,8 @@ class Canvas(QtWidgets.QWidget):
         self.offsets = QtCore.QPoint(), QtCore.QPoint()
         self.scale = 1.0
         self.pixmap = QtGui.QPixmap()
+        # tiles drawn instead of the pixmap for large images
+        self.pyramid = None
         self.visible = {}
         self._hideBackround = False
         self.hideBackround = False
@@ -134,8 +138,8 @@ class Canvas(QtWidgets.QWidget):
         self.selectionToolColor = DEFAULT_SELECTION_TOOL_BASE_COLOR
         self.selectionToolsBaseColor = DEFAULT_SELECTION_TOOL_BASE_COLOR
         self.selectionToolsBlinkColor = DEFAULT_SELECTION_TOOL_BLINK_COLOR
-        self.update_timer = QtCore.QTimer()
-        self.update_timer.timeout.connect(lambda: self.updateTimerHandler())
+        self.update_timer = QtCore.QTimer(self)
+        self.update_timer.timeout.connect(self.updateTimerHandler)
         self.update_timer.start(1000)
         
 
@@ -212,8 +216,7 @@ class Canvas(QtWidgets.QWidget):
 
     def updateSegTreeSelectionUnaryUnion(self):
         if self.segmentation_tree != None:
-            selectedSegments = self.segmentation_tree.collectSelectedSegments()
-            unaryUnionResult = unary_union(selectedSegments)
+            unaryUnionResult = self.segmentation_tree.getSelectionUnion()
             if unaryUnionResult.is_empty:
                 unaryUnionResult = []
             elif unaryUnionResult.geom_type != "Polygon":
@@ -250,6 +253,15 @@ class Canvas(QtWidgets.QWidget):
             raise ValueError("Unsupported createMode: %s" % value)
         self._createMode = value
 
+    @property
+    def shapes(self):
+        return self._shapes
+
+    @shapes.setter
+    def shapes(self, shapes):
+        self._shapes = shapes
+        self.shapeIndex.setShapes(shapes)
+
     def storeShapes(self):
         shapesBackup = []
         for shape in self.shapes:
@@ -435,7 +447,8 @@ class Canvas(QtWidgets.QWidget):
         # - Highlight vertex
         # Update shape/vertex fill and tooltip value accordingly.
         self.setToolTip(self.tr("Image"))
-        for shape in reversed([s for s in self.shapes if self.isVisible(s)]):
+        shapes = self.shapeIndex.shapesNear(pos, self.epsilon / self.scale)
+        for shape in [s for s in shapes if self.isVisible(s)]:
             # Look for a nearby vertex to highlight. If that fails,
             # check if we happen to be inside a shape.
             index = shape.nearestVertex(pos, self.epsilon / self.scale)
@@ -491,6 +504,7 @@ class Canvas(QtWidgets.QWidget):
         if shape is None or index is None or point is None:
             return
         shape.insertPoint(index, point)
+        self.shapeIndex.updateShape(shape)
         shape.highlightVertex(index, shape.MOVE_VERTEX)
         self.hShape = shape
         self.hVertex = index
@@ -503,6 +517,7 @@ class Canvas(QtWidgets.QWidget):
         if shape is None or index is None:
             return
         shape.removePoint(index)
+        self.shapeIndex.updateShape(shape)
         shape.highlightClear()
         self.hShape = shape
         self.prevhVertex = None
@@ -887,9 +902,11 @@ class Canvas(QtWidgets.QWidget):
                 self.shapes.append(shape)
                 self.selectedShapes[i].selected = False
                 self.selectedShapes[i] = shape
+            self.shapeIndex.invalidate()
         else:
             for i, shape in enumerate(self.selectedShapesCopy):
                 self.selectedShapes[i].points = shape.points
+                self.shapeIndex.updateShape(self.selectedShapes[i])
         self.selectedShapesCopy = []
         self.repaint()
         self.storeShapes()
@@ -931,7 +948,7 @@ class Canvas(QtWidgets.QWidget):
             index, shape = self.hVertex, self.hShape
             shape.highlightVertex(index, shape.MOVE_VERTEX)
         else:
-            for shape in reversed(self.shapes):
+            for shape in self.shapeIndex.shapesNear(point):
                 if self.isVisible(shape) and shape.containsPoint(point):
                     self.setHiding()
                     if shape not in self.selectedShapes:
@@ -949,9 +966,9 @@ class Canvas(QtWidgets.QWidget):
         self.deSelectShape()
 
     def calculateOffsets(self, point):
-        left = self.pixmap.width() - 1
+        left = self.imageRect().width() - 1
         right = 0
-        top = self.pixmap.height() - 1
+        top = self.imageRect().height() - 1
         bottom = 0
         for s in self.selectedShapes:
             rect = s.boundingRect()
@@ -976,6 +993,7 @@ class Canvas(QtWidgets.QWidget):
         if self.outOfPixmap(pos):
             pos = self.intersectionPoint(point, pos)
         shape.moveVertexBy(index, pos - point)
+        self.shapeIndex.updateShape(shape)
 
     def boundedMoveShapes(self, shapes, pos):
         if self.outOfPixmap(pos):
@@ -986,8 +1004,8 @@ class Canvas(QtWidgets.QWidget):
         o2 = pos + self.offsets[1]
         if self.outOfPixmap(o2):
             pos += QtCore.QPoint(
-                min(0, self.pixmap.width() - o2.x()),
-                min(0, self.pixmap.height() - o2.y()),
+                min(0, self.imageRect().width() - o2.x()),
+                min(0, self.imageRect().height() - o2.y()),
             )
         # XXX: The next line tracks the new position of the cursor
         # relative to the shape, but also results in making it
@@ -998,6 +1016,7 @@ class Canvas(QtWidgets.QWidget):
         if dp:
             for shape in shapes:
                 shape.moveBy(dp)
+                self.shapeIndex.updateShape(shape)
             self.prevPoint = pos
             return True
         return False
@@ -1015,6 +1034,7 @@ class Canvas(QtWidgets.QWidget):
             for shape in self.selectedShapes:
                 self.shapes.remove(shape)
                 deleted_shapes.append(shape)
+            self.shapeIndex.invalidate()
             self.storeShapes()
             self.selectedShapes = []
             self.update()
@@ -1025,6 +1045,7 @@ class Canvas(QtWidgets.QWidget):
             self.selectedShapes.remove(shape)
         if shape in self.shapes:
             self.shapes.remove(shape)
+            self.shapeIndex.invalidate()
         self.storeShapes()
         self.update()
 
@@ -1045,26 +1066,80 @@ class Canvas(QtWidgets.QWidget):
         if not self.boundedMoveShapes(shapes, point - offset):
             self.boundedMoveShapes(shapes, point + offset)
 
-    def paintSegTreeSelectionUnaryUnion(self, painter):
-        for polygon in self.segmentation_tree_selection_unary_union:
-            if polygon != None:
-                pen = QtGui.QPen(self.selectionToolColor)
-                # Try using integer sizes for smoother drawing(?)
-                pen.setWidth(max(1, int(round(2.0 / self.scale))))
-                painter.setPen(pen)
-
-                line_path = QtGui.QPainterPath()
-                line_path.moveTo(QtCore.QPointF(list(polygon.exterior.coords)[0][0],list(polygon.exterior.coords)[0][1]))
-
-                for i, p in enumerate(list(polygon.exterior.coords)):
-                    line_path.lineTo(QtCore.QPointF(p[0],p[1]))
-                line_path.lineTo(QtCore.QPointF(list(polygon.exterior.coords)[0][0],list(polygon.exterior.coords)[0][1]))
+    @property
+    def segmentation_tree_selection_unary_union(self):
+        return self._segmentation_tree_selection_unary_union
+
+    @segmentation_tree_selection_unary_union.setter
+    def segmentation_tree_selection_unary_union(self, polygons):
+        self._segmentation_tree_selection_unary_union = polygons
+        # rendered again on the next paint
+        self._selectionPath = None
+        self._selectionOverlays = {}
+
+    def getSegTreeSelectionPath(self):
+        if self._selectionPath is None:
+            # the default odd-even fill leaves the holes out
+            path = QtGui.QPainterPath()
+            for polygon in self.segmentation_tree_selection_unary_union:
+                if polygon is None:
+                    continue
+                for ring in [polygon.exterior] + list(polygon.interiors):
+                    path.addPolygon(
+                        QtGui.QPolygonF(
+                            [QtCore.QPointF(x, y) for x, y in ring.coords]
+                        )
+                    )
+                    path.closeSubpath()
+            self._selectionPath = path
+        return self._selectionPath
+
+    def paintSegTreeSelectionPath(self, painter, color):
+        pen = QtGui.QPen(color)
+        # Try using integer sizes for smoother drawing(?)
+        pen.setWidth(max(1, int(round(2.0 / self.scale))))
+        painter.setPen(pen)
+        path = self.getSegTreeSelectionPath()
+        painter.drawPath(path)
+        painter.fillPath(path, color)
+
+    def getSegTreeSelectionOverlay(self, color):
+        """Returns the selection rendered at the image resolution."""
+        key = (color.rgba(), self.scale)
+        overlay = self._selectionOverlays.get(key)
+        if overlay is None:
+            # one overlay per blink color at the current zoom
+            self._selectionOverlays = {
+                k: v
+                for k, v in self._selectionOverlays.items()
+                if k[1] == self.scale
+            }
+            overlay = QtGui.QImage(
+                self.imageRect().size(),
+                QtGui.QImage.Format_ARGB32_Premultiplied,
+            )
+            overlay.fill(QtCore.Qt.transparent)
+            painter = QtGui.QPainter(overlay)
+            painter.setRenderHint(QtGui.QPainter.Antialiasing)
+            self.paintSegTreeSelectionPath(painter, color)
+            painter.end()
+            self._selectionOverlays[key] = overlay
+        return overlay
 
-                painter.drawPath(line_path)
-                painter.fillPath(line_path, self.selectionToolColor)
+    def paintSegTreeSelectionUnaryUnion(self, painter):
+        if not self.segmentation_tree_selection_unary_union:
+            return
+        if self.scale <= 1 and self.pyramid is None:
+            # the image resolution is at least the screen one, blinking
+            # only swaps pre-rendered overlays, too large ones are not kept
+            painter.drawImage(
+                0, 0, self.getSegTreeSelectionOverlay(self.selectionToolColor)
+            )
+        else:
+            self.paintSegTreeSelectionPath(painter, self.selectionToolColor)
 
     def paintEvent(self, event):
-        if not self.pixmap:
+        if not self.pixmap and self.pyramid is None:
             return super(Canvas, self).paintEvent(event)
 
         p = self._painter
@@ -1076,7 +1151,14 @@ class Canvas(QtWidgets.QWidget):
         p.scale(self.scale, self.scale)
         p.translate(self.offsetToCenter())
 
-        p.drawPixmap(0, 0, self.pixmap)
+        # only the part of the image in the exposed rect is drawn
+        exposed = self.getExposedImageRect(event.rect())
+        if self.pyramid is not None:
+            self.pyramid.paint(p, exposed, self.scale)
+        else:
+            source = exposed.toAlignedRect().adjusted(-1, -1, 1, 1)
+            source &= self.pixmap.rect()
+            p.drawPixmap(source.topLeft(), self.pixmap, source)
 
         if not self.selecting() and not self.editing():
         # draw crosshair
@@ -1164,12 +1246,23 @@ class Canvas(QtWidgets.QWidget):
                 #                 p.setPen(pen)
                 #                 p.drawPoint(QtCore.QPointF(contour_points[i][0], contour_points[i][1]))
 
-        for shape in self.shapes:
+        # highlighted handles reach twice the point size around the
+        # vertices, both are drawn at a constant size on screen
+        margin = (2 * Shape.point_size + 2) / self.scale
+        # when zoomed out only the handles of the hovered and selected
+        # shapes are drawn
+        low_zoom = self.scale <= Shape.low_zoom_scale
+        for shape in self.shapeIndex.shapesIn(
+            exposed.left() - margin,
+            exposed.top() - margin,
+            exposed.right() + margin,
+            exposed.bottom() + margin,
+        ):
             if (shape.selected or not self._hideBackround) and self.isVisible(
                 shape
             ):
                 shape.fill = shape.selected or shape == self.hShape
-                shape.paint(p)
+                shape.paint(p, vertices=shape.fill or not low_zoom)
         if self.current:
             self.current.paint(p)
             self.line.paint(p)
@@ -1190,6 +1283,15 @@ class Canvas(QtWidgets.QWidget):
 
         p.end()
 
+    def getExposedImageRect(self, rect):
+        """Returns the part of the image shown in a rect of the widget"""
+        return QtCore.QRectF(
+            self.transformPos(QtCore.QPointF(rect.topLeft())),
+            self.transformPos(
+                QtCore.QPointF(rect.bottomRight() + QtCore.QPoint(1, 1))
+            ),
+        )
+
     def transformPos(self, point):
         """Convert from widget-logical coordinates to painter-logical ones."""
         return point / self.scale - self.offsetToCenter()
@@ -1197,20 +1299,21 @@ class Canvas(QtWidgets.QWidget):
     def offsetToCenter(self):
         s = self.scale
         area = super(Canvas, self).size()
-        w, h = self.pixmap.width() * s, self.pixmap.height() * s
+        w, h = self.imageRect().width() * s, self.imageRect().height() * s
         aw, ah = area.width(), area.height()
         x = (aw - w) / (2 * s) if aw > w else 0
         y = (ah - h) / (2 * s) if ah > h else 0
         return QtCore.QPointF(x, y)
 
     def outOfPixmap(self, p):
-        w, h = self.pixmap.width(), self.pixmap.height()
+        w, h = self.imageRect().width(), self.imageRect().height()
         return not (0 <= p.x() <= w - 1 and 0 <= p.y() <= h - 1)
 
     def finalise(self):
         assert self.current
         self.current.close()
         self.shapes.append(self.current)
+        self.shapeIndex.invalidate()
         self.storeShapes()
         self.current = None
         self.setHiding(False)
@@ -1228,7 +1331,7 @@ class Canvas(QtWidgets.QWidget):
         # Cycle through each image edge in clockwise fashion,
         # and find the one intersecting the current line segment.
         # http://paulbourke.net/geometry/lineline2d/
-        size = self.pixmap.size()
+        size = self.imageRect().size()
         points = [
             (0, 0),
             (size.width() - 1, 0),
@@ -1285,8 +1388,8 @@ class Canvas(QtWidgets.QWidget):
         return self.minimumSizeHint()
 
     def minimumSizeHint(self):
-        if self.pixmap:
-            return self.scale * self.pixmap.size()
+        if self.pixmap or self.pyramid is not None:
+            return self.scale * self.imageRect().size()
         return super(Canvas, self).minimumSizeHint()
 
     def adjustContourRadius(self, scroll_delta):
@@ -1373,6 +1476,7 @@ class Canvas(QtWidgets.QWidget):
                         new_shape.addPoint(QtCore.QPoint(int(point[0]), int(point[1])))
                     new_shape.close()
                     self.shapes.append(new_shape)
+                    self.shapeIndex.invalidate()
                     self.storeShapes()
                     self.setHiding(False)
                     self.newShape.emit()
@@ -1422,6 +1526,7 @@ class Canvas(QtWidgets.QWidget):
     def undoLastLine(self):
         assert self.shapes
         self.current = self.shapes.pop()
+        self.shapeIndex.invalidate()
         self.current.setOpen()
         if self.createMode in ["polygon", "linestrip"]:
             self.line.points = [self.current[-1], self.current[0]]
@@ -1442,17 +1547,42 @@ class Canvas(QtWidgets.QWidget):
             self.drawingPolygon.emit(False)
         self.update()
 
+    def imageRect(self):
+        if self.pyramid is not None:
+            return self.pyramid.rect()
+        return self.pixmap.rect()
+
     def loadPixmap(self, pixmap, clear_shapes=True):
+        self.setImagePyramid(None)
         self.pixmap = pixmap
+        self._selectionOverlays = {}
         if clear_shapes:
             self.shapes = []
         self.update()
 
+    def loadImagePyramid(self, pyramid, clear_shapes=True):
+        """Shows a large image through its tiles, see ImagePyramid"""
+        self.setImagePyramid(pyramid)
+        self.pixmap = QtGui.QPixmap()
+        self._selectionOverlays = {}
+        if clear_shapes:
+            self.shapes = []
+        self.update()
+
+    def setImagePyramid(self, pyramid):
+        if self.pyramid is not None:
+            self.pyramid.tileLoaded.disconnect(self.update)
+            self.pyramid.shutdown()
+        self.pyramid = pyramid
+        if pyramid is not None:
+            pyramid.tileLoaded.connect(self.update)
+
     def loadShapes(self, shapes, replace=True):
         if replace:
             self.shapes = list(shapes)
         else:
             self.shapes.extend(shapes)
+            self.shapeIndex.invalidate()
         self.storeShapes()
         self.current = None
         self.hShape = None
@@ -1474,6 +1604,7 @@ class Canvas(QtWidgets.QWidget):
 
     def resetState(self):
         self.restoreCursor()
+        self.setImagePyramid(None)
         self.pixmap = None
         self.shapesBackups = []
         self.update()
@@ -145,6 +145,7 @@ def main():
         entry_points={
             "console_scripts": [
                 "labelme=labelme.__main__:main",
+                "labelme_build_segtrees=labelme.cli.build_segtrees:main",
                 "labelme_draw_json=labelme.cli.draw_json:main",
                 "labelme_draw_label_png=labelme.cli.draw_label_png:main",
                 "labelme_json_to_dataset=labelme.cli.json_to_dataset:main",
@@ -1,11 +1,14 @@
 import os.path as osp
 import shutil
 import tempfile
+import threading
 
 import pytest
 
 import labelme.app
 import labelme.config
+import labelme.segmentationTree
+import labelme.segmentationTreeLoader
 import labelme.testing
 
 
@@ -111,3 +114,90 @@ def test_MainWindow_annotate_jpg(qtbot):
 
     labelme.testing.assert_labelfile_sanity(out_file)
     shutil.rmtree(tmp_dir)
+
+
+@pytest.mark.gui
+def test_MainWindow_loadSegTree(qtbot):
+    tmp_dir = tempfile.mkdtemp()
+    img_file = osp.join(tmp_dir, "2011_000003.jpg")
+    shutil.copy(osp.join(data_dir, "raw/2011_000003.jpg"), img_file)
+
+    win = labelme.app.MainWindow(filename=img_file)
+    qtbot.addWidget(win)
+    _win_show_and_wait_imageData(qtbot, win)
+    # the image is usable while the tree is built in the background
+    assert win.canvas.isEnabled()
+
+    def check_segmentation_tree():
+        assert win.canvas.segmentation_tree is not None
+
+    qtbot.waitUntil(check_segmentation_tree, timeout=60000)
+    seg_tree = win.canvas.segmentation_tree
+    # segments can be selected while the gaps are filled
+    assert win.setSegmentationTree()
+
+    # the gaps between the segments are filled and cached afterwards
+    seg_tree_file = osp.join(tmp_dir, "2011_000003_seg_tree.bin")
+
+    def check_seg_tree_cached():
+        assert win.segTreeLoader is None
+        assert osp.exists(seg_tree_file)
+
+    qtbot.waitUntil(check_seg_tree_cached, timeout=60000)
+    assert win.canvas.segmentation_tree is seg_tree
+    cached, _ = labelme.segmentationTreeLoader.readSegTreeFile(seg_tree_file)
+    assert len(cached.getPreOrderNodes()[0]) == len(
+        seg_tree.getPreOrderNodes()[0]
+    )
+    win.close()
+    shutil.rmtree(tmp_dir)
+
+
+@pytest.mark.gui
+def test_MainWindow_prefetch(qtbot, monkeypatch):
+    tmp_dir = tempfile.mkdtemp()
+    for name in ["2011_000003.jpg", "2011_000006.jpg"]:
+        shutil.copy(osp.join(data_dir, "raw", name), tmp_dir)
+    # a label file without image data, which reads the image file
+    shutil.copy(osp.join(data_dir, "annotated", "2011_000006.json"), tmp_dir)
+
+    win = labelme.app.MainWindow(filename=tmp_dir)
+    qtbot.addWidget(win)
+    _win_show_and_wait_imageData(qtbot, win)
+
+    next_file = win.imageList[1]
+    future = win.prefetcher.pendingSegTree(next_file)
+    assert future is not None
+    future.result(timeout=60)
+
+    win.openNextImg()
+    assert win.filename == next_file
+    assert win.labelFile is not None
+    assert win.prefetcher.image_hits == 1
+    assert win.image is win.prefetcher._entries[next_file].image
+    assert win.prefetcher.seg_tree_hits == 1
+    assert win.canvas.segmentation_tree is not None
+
+    # a tree shown again while its raster is loading reuses the thread
+    done = threading.Event()
+    threads = []
+
+    def startLoadingSegTreeRaster(seg_tree, *args):
+        threads.append(threading.Thread(target=done.wait))
+        threads[-1].start()
+        return threads[-1]
+
+    monkeypatch.setattr(
+        labelme.segmentationTreeLoader,
+        "startLoadingSegTreeRaster",
+        startLoadingSegTreeRaster,
+    )
+    seg_tree = labelme.segmentationTree.SegmentationTree()
+    for _ in range(2):
+        win.startLoadingSegTreeRaster(seg_tree, "seg_tree.bin", None)
+    assert len(threads) == 1
+    done.set()
+    # and the window waits for it
+    win.close()
+    assert not threads[0].is_alive()
+    shutil.rmtree(tmp_dir)
@@ -0,0 +1,65 @@
+import os
+import os.path as osp
+import shutil
+import tempfile
+
+import numpy as np
+
+from labelme.cli import build_segtrees
+from labelme.segmentationTreeLoader import getSegTreeFilename
+from labelme.segmentationTreeLoader import getSegTreeRasterFilename
+from labelme.segmentationTreeLoader import loadSegTreeRaster
+from labelme.segmentationTreeLoader import readSegTreeFile
+from labelme.utils import scanAllImages
+
+
+here = osp.dirname(osp.abspath(__file__))
+data_dir = osp.join(here, "data")
+
+
+def test_buildSegTrees():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        img_file = osp.join(tmp_dir, "2011_000003.jpg")
+        shutil.copy(osp.join(data_dir, "raw/2011_000003.jpg"), img_file)
+        broken_file = osp.join(tmp_dir, "broken.jpg")
+        with open(broken_file, "wb") as f:
+            f.write(b"not an image")
+        image_files = scanAllImages(tmp_dir)
+        assert image_files == [img_file, broken_file]
+
+        failed = {}
+        assert build_segtrees.buildSegTrees(image_files, 1, failed) == 1
+        seg_tree_file = getSegTreeFilename(img_file)
+        raster_file = getSegTreeRasterFilename(seg_tree_file)
+        assert build_segtrees.isUpToDate(img_file)
+        assert failed == {broken_file: osp.getmtime(broken_file)}
+        # the caches are found by the app
+        seg_tree, _ = readSegTreeFile(seg_tree_file)
+        raster = loadSegTreeRaster(seg_tree, seg_tree_file)
+        np.testing.assert_array_equal(raster.leaf, seg_tree.buildRaster().leaf)
+        assert scanAllImages(tmp_dir) == image_files
+
+        # up to date caches and failed images are skipped
+        mtimes = [osp.getmtime(seg_tree_file), osp.getmtime(raster_file)]
+        assert build_segtrees.buildSegTrees(image_files, 1, failed) == 0
+        assert [
+            osp.getmtime(seg_tree_file),
+            osp.getmtime(raster_file),
+        ] == mtimes
+
+        # until they change
+        mtime = (
+            max(osp.getmtime(seg_tree_file), osp.getmtime(raster_file)) + 10
+        )
+        os.utime(img_file, (mtime, mtime))
+        os.utime(broken_file, (mtime, mtime))
+        assert not build_segtrees.isUpToDate(img_file)
+        assert build_segtrees.buildSegTrees(image_files, 1, failed) == 1
+        assert failed == {broken_file: mtime}
+
+        # images removed since the scan are skipped
+        missing_file = osp.join(tmp_dir, "missing.jpg")
+        assert build_segtrees.buildSegTrees([missing_file], 1, failed) == 0
+    finally:
+        shutil.rmtree(tmp_dir)
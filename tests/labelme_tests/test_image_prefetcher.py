@@ -0,0 +1,54 @@
+import os
+import os.path as osp
+import shutil
+import tempfile
+
+from qtpy import QtGui
+
+from labelme import imagePyramid
+from labelme.imagePrefetcher import ImagePrefetcher
+
+
+here = osp.dirname(osp.abspath(__file__))
+data_dir = osp.join(here, "data")
+
+
+def test_ImagePrefetcher_skip():
+    tmp_dir = tempfile.mkdtemp()
+    prefetcher = ImagePrefetcher(num_images=2)
+    try:
+        img_file = osp.join(tmp_dir, "2011_000003.jpg")
+        shutil.copy(osp.join(data_dir, "raw/2011_000003.jpg"), img_file)
+        broken_file = osp.join(tmp_dir, "broken.jpg")
+        with open(broken_file, "wb") as f:
+            f.write(b"not an image")
+        large_file = osp.join(tmp_dir, "large.png")
+        side = int(imagePyramid.PYRAMID_MIN_PIXELS ** 0.5)
+        large = QtGui.QImage(side, side, QtGui.QImage.Format_Mono)
+        large.fill(0)
+        assert large.save(large_file)
+        image_list = [img_file, broken_file, large_file]
+
+        prefetcher.prefetch(image_list, 0)
+        futures = {f: prefetcher._entries[f].future for f in image_list[1:]}
+        for future in futures.values():
+            future.exception(timeout=60)
+        assert prefetcher.getImage(broken_file) == (None, None)
+        assert prefetcher.getImage(large_file) == (None, None)
+
+        # failed and large images are not loaded again
+        prefetcher.prefetch(image_list, 0)
+        for filename, future in futures.items():
+            assert prefetcher._entries[filename].future is future
+
+        # until they are modified
+        mtime = osp.getmtime(broken_file) + 10
+        os.utime(broken_file, (mtime, mtime))
+        prefetcher.prefetch(image_list, 0)
+        assert prefetcher._entries[broken_file].future is not (
+            futures[broken_file]
+        )
+        assert prefetcher._entries[large_file].future is futures[large_file]
+    finally:
+        prefetcher.shutdown()
+        shutil.rmtree(tmp_dir)
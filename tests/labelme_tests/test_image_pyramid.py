@@ -0,0 +1,106 @@
+import os
+import os.path as osp
+import shutil
+import tempfile
+
+from qtpy import QtCore
+from qtpy import QtGui
+
+from labelme import imagePyramid
+from labelme.utils import scanAllImages
+from labelme.widgets import Canvas
+
+
+def makeImage(width, height):
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    image.fill(QtGui.QColor(0, 0, 255))
+    painter = QtGui.QPainter(image)
+    painter.fillRect(0, 0, width // 2, height, QtGui.QColor(255, 0, 0))
+    painter.end()
+    return image
+
+
+def test_ImagePyramid(qtbot):
+    image = makeImage(1500, 1100)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cache_dirname = osp.join(tmp_dir, "image_tiles")
+        pyramid = imagePyramid.ImagePyramid(image, cache_dirname)
+        # 1500x1100, 750x550 and 375x275
+        assert pyramid.num_levels == 3
+        assert pyramid.getLevel(2) == 0
+        assert pyramid.getLevel(0.5) == 1
+        assert pyramid.getLevel(0.01) == 2
+
+        with qtbot.waitSignal(pyramid.tileLoaded, timeout=10000):
+            assert pyramid.getTile(2, 0, 0) is None
+        tile = pyramid.getTile(2, 0, 0)
+        assert tile.size() == QtCore.QSize(375, 275)
+        assert QtGui.QColor(tile.pixel(10, 10)) == QtGui.QColor(255, 0, 0)
+        assert QtGui.QColor(tile.pixel(365, 265)) == QtGui.QColor(0, 0, 255)
+        assert pyramid.makeTile(1, 1, 1).size() == QtCore.QSize(238, 38)
+        pyramid.shutdown()
+        assert sorted(os.listdir(cache_dirname)) == [
+            "1_0_0.png",
+            "1_0_1.png",
+            "1_1_0.png",
+            "1_1_1.png",
+            "2_0_0.png",
+        ]
+
+        # tiles are read back from the cache, not made from the image
+        black = QtGui.QImage(1500, 1100, QtGui.QImage.Format_RGB32)
+        black.fill(QtGui.QColor(0, 0, 0))
+        cached = imagePyramid.ImagePyramid(black, cache_dirname)
+        argb32 = QtGui.QImage.Format_ARGB32
+        assert cached.makeTile(2, 0, 0).convertToFormat(
+            argb32
+        ) == tile.convertToFormat(argb32)
+        cached.shutdown()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_scanAllImages_skipsTiles():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        img_file = osp.join(tmp_dir, "image.png")
+        image = makeImage(1500, 1100)
+        assert image.save(img_file)
+        cache_dirname = imagePyramid.getImagePyramidDirname(img_file)
+        pyramid = imagePyramid.ImagePyramid(image, cache_dirname)
+        pyramid.makeTile(2, 0, 0)
+        pyramid.shutdown()
+        assert os.listdir(cache_dirname)
+        # only directories of tiles next to their image are skipped
+        other_file = osp.join(tmp_dir, "other_tiles", "image.png")
+        os.makedirs(osp.dirname(other_file))
+        shutil.copy(img_file, other_file)
+
+        assert scanAllImages(tmp_dir) == [img_file, other_file]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_Canvas_loadImagePyramid(qtbot):
+    canvas = Canvas()
+    qtbot.addWidget(canvas)
+    image = makeImage(1500, 1100)
+    pyramid = imagePyramid.ImagePyramid(image)
+    canvas.loadImagePyramid(pyramid)
+    assert canvas.imageRect() == QtCore.QRect(0, 0, 1500, 1100)
+    assert canvas.minimumSizeHint() == QtCore.QSize(1500, 1100)
+
+    canvas.scale = 0.25
+    canvas.resize(375, 275)
+    rendered = QtGui.QImage(375, 275, QtGui.QImage.Format_ARGB32)
+    # the preview is drawn until the tiles are made
+    canvas.render(rendered)
+    assert QtGui.QColor(rendered.pixel(10, 10)) == QtGui.QColor(255, 0, 0)
+    qtbot.waitUntil(lambda: pyramid.getCachedTile((2, 0, 0)) is not None)
+    canvas.render(rendered)
+    assert QtGui.QColor(rendered.pixel(365, 265)) == QtGui.QColor(0, 0, 255)
+
+    canvas.loadPixmap(QtGui.QPixmap(100, 100))
+    assert canvas.pyramid is None
+    assert canvas.imageRect() == QtCore.QRect(0, 0, 100, 100)
@@ -0,0 +1,629 @@
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import os.path as osp
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+import pytest
+import shapely
+import shapely.geometry
+from qtpy import QtGui
+
+import labelme.flatSegmentationTree
+import labelme.segmentationTree
+import labelme.segmentationTreeBuilder
+import labelme.segmentationTreeLoader
+import labelme.segmentationTreeTopology
+
+
+here = osp.dirname(osp.abspath(__file__))
+data_dir = osp.join(here, "data")
+
+
+def test_createRegionList():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    regions, num_regions = labelme.segmentationTreeBuilder.createRegionList(
+        img_file
+    )
+    assert num_regions == len(regions)
+    assert num_regions > 1
+
+    height, width = 338, 500
+    size, contrast_level, boundary, parent = regions[0]
+    assert size == height * width
+    assert parent == -1
+    for i, (size, contrast_level, boundary, parent) in enumerate(regions):
+        assert 0 < size <= height * width
+        assert contrast_level >= 0
+        assert parent < i
+        if i > 0:
+            assert contrast_level <= regions[parent][1]
+        for x, y in boundary:
+            assert 0 <= x < width
+            assert 0 <= y < height
+
+    with open(img_file, "rb") as f:
+        regions_from_data, _ = (
+            labelme.segmentationTreeBuilder.createRegionList(f.read())
+        )
+    assert [r[:2] for r in regions_from_data] == [r[:2] for r in regions]
+
+
+def test_createRegionList_tinyImages():
+    # too small for the watershed to keep any marker
+    for height, width in [(1, 1), (3, 3), (4, 4), (5, 5), (3, 40), (40, 2)]:
+        image = np.random.RandomState(0).randint(0, 255, (height, width, 3))
+        labels = labelme.segmentationTreeBuilder.overSegment(
+            image.astype(np.uint8), 8
+        )
+        assert labels.shape == (height, width)
+        _, encoded = cv2.imencode(".png", image.astype(np.uint8))
+        regions, num_regions = (
+            labelme.segmentationTreeBuilder.createRegionList(
+                encoded.tobytes()
+            )
+        )
+        assert regions[0][0] == height * width
+
+    root, _ = labelme.segmentationTree.createSegTree(encoded.tobytes())
+    assert root.polygon.area > 0
+
+
+def test_createSegTree():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, contrast_levels = labelme.segmentationTree.createSegTree(img_file)
+    assert contrast_levels == sorted(contrast_levels, reverse=True)
+    assert root.children
+    assert root.polygon.area > 0
+
+
+def test_ReadRegionList():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    regions, num_regions = labelme.segmentationTreeBuilder.createRegionList(
+        img_file
+    )
+
+    tmp_dir = tempfile.mkdtemp()
+    general_data_file = osp.join(tmp_dir, "2011_000003_GeneralData.bin")
+    boundary_data_file = osp.join(tmp_dir, "2011_000003_BoundaryData.bin")
+    labelme.segmentationTreeBuilder.writeRegionList(
+        regions, general_data_file, boundary_data_file
+    )
+    regions_read, num_regions_read = labelme.segmentationTree.ReadRegionList(
+        general_data_file, boundary_data_file
+    )
+    assert num_regions_read == num_regions
+    for region, region_read in zip(regions, regions_read):
+        assert region_read[:2] == region[:2]
+        assert region_read[3] == region[3]
+        np.testing.assert_array_equal(region_read[2], region[2])
+
+    # files without parents are still readable
+    labelme.segmentationTreeBuilder.writeRegionList(
+        [region[:3] + [None] for region in regions],
+        general_data_file,
+        boundary_data_file,
+    )
+    regions_read, _ = labelme.segmentationTree.ReadRegionList(
+        general_data_file, boundary_data_file
+    )
+    assert [r[:2] for r in regions_read] == [r[:2] for r in regions]
+    assert all(r[3] is None for r in regions_read)
+    del regions_read
+    shutil.rmtree(tmp_dir)
+
+
+def getRegionParents(region_trees, roots):
+    region_of = {
+        id(tree): i for i, trees in enumerate(region_trees) for tree in trees
+    }
+    parents = {region_of[id(root)]: -1 for root in roots}
+    for trees in region_trees:
+        for tree in trees:
+            for child in tree.children:
+                parents[region_of[id(child)]] = region_of[id(tree)]
+    return parents
+
+
+def test_linkSegTreeByContainment():
+    def box(x0, y0, x1, y1):
+        return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])
+
+    # [size, contrast_level, boundary, parent], parents first
+    regions = [
+        [10000, 50, box(0, 0, 100, 100), -1],
+        [2500, 40, box(0, 0, 50, 50), 0],
+        [5000, 40, box(50, 0, 100, 100), 0],
+        [400, 30, box(10, 10, 30, 30), 1],
+        [400, 30, box(60, 10, 80, 30), 2],
+        [100, 20, box(62, 12, 72, 22), 4],
+        [400, 30, box(60, 50, 80, 70), 2],
+    ]
+    parents = []
+    for link in [
+        lambda trees, region_trees: (
+            labelme.segmentationTree.linkSegTreeByMergeOrder(
+                regions, region_trees
+            )
+        ),
+        lambda trees, region_trees: (
+            labelme.segmentationTree.linkSegTreeByContainment(trees)
+        ),
+    ]:
+        trees, region_trees, contrast_levels = (
+            labelme.segmentationTree.createRegionTrees(regions, len(regions))
+        )
+        roots = link(trees, region_trees)
+        parents.append(getRegionParents(region_trees, roots))
+    assert parents[0] == {i: region[3] for i, region in enumerate(regions)}
+    assert parents[1] == parents[0]
+
+    # traced boundaries of neighbours overlap, containment links every
+    # node under a region containing it
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    regions, num_regions = labelme.segmentationTreeBuilder.createRegionList(
+        img_file
+    )
+    trees, region_trees, _ = labelme.segmentationTree.createRegionTrees(
+        regions, num_regions
+    )
+    roots = labelme.segmentationTree.linkSegTreeByContainment(trees)
+    assert sum(len(root.getPreOrderNodes()[0]) for root in roots) == len(
+        trees
+    )
+    for tree in trees:
+        for child in tree.children:
+            assert tree.polygon.contains(child.polygon)
+
+
+def test_createSegTree_legacyRegionList():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    regions, num_regions = labelme.segmentationTreeBuilder.createRegionList(
+        img_file
+    )
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        general_data_file = osp.join(tmp_dir, "2011_000003_GeneralData.bin")
+        boundary_data_file = osp.join(
+            tmp_dir, "2011_000003_BoundaryData.bin"
+        )
+        # written without the merge order, linked by containment
+        labelme.segmentationTreeBuilder.writeRegionList(
+            [region[:3] + [None] for region in regions[1:]],
+            general_data_file,
+            boundary_data_file,
+        )
+        root, contrast_levels = labelme.segmentationTree.createSegTree(
+            None,
+            regions=labelme.segmentationTree.ReadRegionList(
+                general_data_file, boundary_data_file
+            ),
+        )
+        assert contrast_levels == sorted(
+            {region[1] for region in regions[1:]}, reverse=True
+        )
+        # without the whole image region the top regions are put under a
+        # new root
+        assert root.contrast_level == -1
+        trees, _, _ = labelme.segmentationTree.createRegionTrees(
+            regions[1:], num_regions - 1
+        )
+        assert len(root.getPreOrderNodes()[0]) == len(trees) + 1
+        del root
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_loadSegTree():
+    tmp_dir = tempfile.mkdtemp()
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    seg_tree_file = labelme.segmentationTreeLoader.getSegTreeFilename(
+        osp.join(tmp_dir, "2011_000003.jpg")
+    )
+    with open(img_file, "rb") as f:
+        image_data = f.read()
+
+    messages = []
+    root, contrast_levels = labelme.segmentationTreeLoader.loadSegTree(
+        seg_tree_file, image_data, messages.append
+    )
+    assert messages
+    assert osp.exists(seg_tree_file)
+
+    # the second load reads the cache
+    root_read, contrast_levels_read = (
+        labelme.segmentationTreeLoader.loadSegTree(seg_tree_file, None)
+    )
+    assert contrast_levels_read == contrast_levels
+    assert len(root_read.children) == len(root.children)
+    assert root_read.polygon.equals(root.polygon)
+    # the coordinates are left memory mapped
+    coords = root_read.children[0].getCoords()
+    base = coords
+    while isinstance(base.base, np.ndarray):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    assert coords.dtype == np.float32
+
+    # caches of the first version stored float64 coordinates
+    arrays = list(root.getSegTreeAsArrays(contrast_levels))
+    arrays[2] = arrays[2].astype(np.float64)
+    v1_file = osp.join(tmp_dir, "v1_seg_tree.bin")
+    with open(v1_file, "wb") as f:
+        f.write(b"LMSEGTR1")
+        f.write(np.array([len(a) for a in arrays], dtype=np.int64).tobytes())
+        for array in arrays:
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(array.tobytes())
+    root_v1, contrast_levels_v1 = (
+        labelme.segmentationTreeLoader.readSegTreeFile(v1_file)
+    )
+    assert contrast_levels_v1 == contrast_levels
+    assert root_v1.polygon.equals(root.polygon)
+
+    # JSON caches are read and upgraded to the binary format
+    os.remove(seg_tree_file)
+    json_file = labelme.segmentationTreeLoader.getJSONSegTreeFilename(
+        seg_tree_file
+    )
+    with open(json_file, "w") as f:
+        json.dump(root.getSegTreeAsDictArray(contrast_levels), f)
+    root_read, contrast_levels_read = (
+        labelme.segmentationTreeLoader.loadSegTree(seg_tree_file, None)
+    )
+    assert osp.exists(seg_tree_file)
+    assert contrast_levels_read == contrast_levels
+    assert len(root_read.children) == len(root.children)
+    shutil.rmtree(tmp_dir)
+
+
+def test_SegTreeLoader(qtbot):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+        seg_tree_file = osp.join(tmp_dir, "2011_000003_seg_tree.bin")
+        with open(img_file, "rb") as f:
+            image_data = f.read()
+        loader = labelme.segmentationTreeLoader.SegTreeLoader(
+            seg_tree_file, image_data
+        )
+        num_built = []
+        loader.built.connect(
+            lambda seg_tree, _: num_built.append(
+                len(seg_tree.getPreOrderNodes()[0])
+            )
+        )
+        with qtbot.waitSignal(loader.loaded, timeout=60000) as blocker:
+            loader.start()
+        loader.wait()
+        # the tree in use is not changed by the loader, the receiver adds
+        # the children it found
+        seg_tree, contrast_levels = blocker.args
+        assert len(seg_tree.getPreOrderNodes()[0]) == num_built[0]
+        assert loader.missing_children
+        assert not osp.exists(seg_tree_file)
+        seg_tree.addMissingChildren(loader.missing_children)
+        assert len(seg_tree.getPreOrderNodes()[0]) == num_built[0] + sum(
+            len(polygons) for _, polygons in loader.missing_children
+        )
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_FlatSegmentationTree():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, contrast_levels = labelme.segmentationTree.createSegTree(img_file)
+    arrays = root.getSegTreeAsArrays(contrast_levels)
+    root = labelme.segmentationTree.SegmentationTree()
+    root.loadSegTreeFromArrays(*arrays)
+    flat, flat_contrast_levels = (
+        labelme.flatSegmentationTree.FlatSegmentationTree.fromArrays(*arrays)
+    )
+    assert flat_contrast_levels == contrast_levels
+
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack += node.children[::-1]
+    assert len(flat) == len(nodes)
+
+    for pos in [(10, 10), (250, 170), (400, 300)]:
+        root.updateHovering(pos)
+        flat.updateHovering(pos)
+        assert [node.hovered for node in nodes] == flat.hovered.tolist()
+
+        root.editSegmentSelectionAtContrastLevel(pos, contrast_levels[1])
+        flat.editSegmentSelectionAtContrastLevel(pos, contrast_levels[1])
+        assert [node.selected for node in nodes] == flat.selected.tolist()
+
+    contour = shapely.geometry.Point(200, 150).buffer(40)
+    root.editSegmentSelectionWithVariableWidthContour(contour, True, False)
+    flat.editSegmentSelectionWithVariableWidthContour(contour, True, False)
+    assert [node.selected for node in nodes] == flat.selected.tolist()
+    assert len(flat.collectSelectedSegments()) == len(
+        root.collectSelectedSegments()
+    )
+
+    flat.removeSelection()
+    assert not flat.selected.any()
+    flat_arrays = flat.getSegTreeAsArrays(contrast_levels)
+    for array, flat_array in zip(arrays, flat_arrays):
+        np.testing.assert_array_equal(flat_array, array)
+
+
+def test_loadSegTreeFromArrays():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, contrast_levels = labelme.segmentationTree.createSegTree(img_file)
+    root_read = labelme.segmentationTree.SegmentationTree()
+    arrays = root.getSegTreeAsArrays(contrast_levels)
+    assert root_read.loadSegTreeFromArrays(*arrays) == contrast_levels
+
+    # geometry is only built when used
+    child = root_read.children[0]
+    assert child._polygon is None
+    np.testing.assert_allclose(child.area, child.polygon.area)
+    np.testing.assert_allclose(child.bbox, child.polygon.bounds)
+    assert child._polygon is not None
+
+
+def test_updateHovering():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, _ = labelme.segmentationTree.createSegTree(img_file)
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack += node.children
+
+    for pos in [(10, 10), (250, 170), (499, 337)]:
+        root.updateHovering(pos)
+        hovered = [node for node in nodes if node.hovered]
+        assert hovered
+        assert sorted(map(id, hovered)) == sorted(
+            map(id, root.cache.hovered_nodes)
+        )
+        for node in hovered:
+            assert node.polygon.contains(shapely.geometry.Point(pos))
+            assert not any(child.hovered for child in node.children)
+
+
+def test_deepSegTree():
+    # nested squares, deeper than the recursion limit
+    depth = 5000
+    nodes = [
+        labelme.segmentationTree.SegmentationTree(
+            polygon=shapely.geometry.box(-size, -size, size, size),
+            contrast_level=i,
+        )
+        for i, size in enumerate(range(depth, 0, -1))
+    ]
+    for parent, child in zip(nodes, nodes[1:]):
+        parent.children = [child]
+    root, innermost = nodes[0], nodes[-1]
+
+    root.updateHovering((0, 0))
+    # every other node, from the innermost one up
+    assert root.cache.hovered_nodes == nodes[::-2]
+    root.editSegmentSelectionAtContrastLevel((0, 0), depth - 1)
+    assert innermost.selected
+    assert root.selectedSegmentContainsPoint(shapely.geometry.Point(0, 0))
+    assert len(root.collectSelectedSegments()) == 1
+    # the state of the tree is only kept by the root
+    assert all(node._cache is None for node in nodes[1:])
+    root.removeSelection()
+    assert not innermost.selected
+
+    dict_array = [list(range(depth))] + root.convertSegTreeToDictArray()
+    copy = labelme.segmentationTree.SegmentationTree()
+    assert copy.convertDictArrayToSegTree(dict_array) == list(range(depth))
+    assert copy.convertSegTreeToDictArray() == dict_array[1:]
+
+    flat, _ = labelme.flatSegmentationTree.FlatSegmentationTree.fromSegTree(
+        root, list(range(depth))
+    )
+    flat.updateHovering((0, 0))
+    assert np.flatnonzero(flat.hovered).tolist() == list(
+        range(depth - 1, -1, -2)
+    )[::-1]
+    # only the two innermost squares are mostly covered
+    contour = shapely.geometry.box(-2, -2, 2, 2)
+    flat.editSegmentSelectionWithVariableWidthContour(contour, True, False)
+    assert np.flatnonzero(flat.selected).tolist() == [depth - 2]
+    flat.removeSelection()
+    flat.selected[0] = True
+    flat.editSegmentSelectionWithVariableWidthContour(contour, False, False)
+    assert not flat.selected.any()
+
+
+def test_SegTreeRaster():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, contrast_levels = labelme.segmentationTree.createSegTree(img_file)
+    nodes, _ = root.getPreOrderNodes()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        seg_tree_file = osp.join(tmp_dir, "2011_000003_seg_tree.bin")
+        raster = labelme.segmentationTreeLoader.loadSegTreeRaster(
+            root, seg_tree_file
+        )
+        assert root.raster is raster
+        raster_file = labelme.segmentationTreeLoader.getSegTreeRasterFilename(
+            seg_tree_file
+        )
+        assert osp.exists(raster_file)
+        loaded = root.loadRaster(raster_file)
+        np.testing.assert_array_equal(loaded.leaf, raster.leaf)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    for pos in [(10, 10), (250, 170), (499, 337)]:
+        index = raster.leafAt(*pos)
+        point = shapely.geometry.Point(pos)
+        assert nodes[index].polygon.distance(point) <= 1
+        for child in nodes[index].children:
+            assert child.polygon.distance(point) > 0
+
+        ancestors = list(raster.ancestors(index))
+        assert ancestors[-1] == 0
+        for child, parent in zip(ancestors, ancestors[1:]):
+            assert nodes[child] in nodes[parent].children
+
+        root.updateHovering(pos)
+        assert nodes[index].hovered
+
+
+def test_paintContrastLevel():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, contrast_levels = labelme.segmentationTree.createSegTree(img_file)
+    nodes, _ = root.getPreOrderNodes()
+    flat, _ = labelme.flatSegmentationTree.FlatSegmentationTree.fromSegTree(
+        root, contrast_levels
+    )
+
+    level = contrast_levels[len(contrast_levels) // 2]
+    at_level = [node for node in nodes if node.contrast_level == level]
+    assert root.getContrastLevelNodes(level) == at_level
+    assert (
+        root.getContrastLevelPath(level).elementCount()
+        == flat.getContrastLevelPath(level).elementCount()
+        == sum(node.getPainterPath().elementCount() for node in at_level)
+    )
+
+    assert root.getSelectedNodes() == []
+    selection = at_level[0].polygon.buffer(1)
+    root.selectSegmentsWithPercentAreaAndBoundary(selection)
+    assert root.getSelectedNodes() == [node for node in nodes if node.selected]
+    assert root.getSelectedNodes()
+    flat.selectSegmentsWithPercentAreaAndBoundary(selection)
+
+    x, y = at_level[0].polygon.representative_point().coords[0]
+    for tree in [root, flat]:
+        image = QtGui.QImage(500, 375, QtGui.QImage.Format_ARGB32)
+        image.fill(0)
+        painter = QtGui.QPainter(image)
+        tree.paintContrastLevel(painter, level, QtGui.QColor(255, 0, 0, 128))
+        painter.end()
+        assert image.pixel(int(x), int(y)) != 0
+
+
+def test_getSelectionUnion():
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, contrast_levels = labelme.segmentationTree.createSegTree(img_file)
+    flat, _ = labelme.flatSegmentationTree.FlatSegmentationTree.fromSegTree(
+        root, contrast_levels
+    )
+
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        contour = shapely.geometry.Point(
+            rng.uniform(0, 500), rng.uniform(0, 375)
+        ).buffer(rng.uniform(10, 60))
+        adding = bool(rng.integers(2))
+        for tree in [root, flat]:
+            tree.editSegmentSelectionWithVariableWidthContour(
+                contour, adding, False
+            )
+            expected = shapely.unary_union(tree.collectSelectedSegments())
+            union = tree.getSelectionUnion()
+            assert union.symmetric_difference(expected).area < 1e-6 * max(
+                expected.area, 1
+            )
+    root.removeSelection()
+    assert root.getSelectionUnion().is_empty
+
+
+def test_SegTreeTopology():
+    labels = np.array(
+        [
+            [1, 1, 1, 1, 0],
+            [1, 2, 2, 1, 0],
+            [1, 2, 3, 1, 4],
+            [1, 1, 1, 4, 0],
+        ]
+    )
+    topology = labelme.segmentationTreeTopology.SegTreeTopology.fromLabels(
+        labels
+    )
+    for inside_labels in [[1], [2], [1, 3], [1, 4], [1, 2, 3, 4]]:
+        inside = np.isin(np.arange(5), inside_labels)
+        union = topology.getUnion(inside)
+        assert union.is_valid
+        assert union.area == inside[labels].sum()
+    # label 1 surrounds 2 and 3
+    assert len(topology.getUnion(np.isin(np.arange(5), [1])).interiors) == 1
+
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, _ = labelme.segmentationTree.createSegTree(img_file)
+    raster = root.buildRaster()
+    raster.buildTopology()
+    root.setRaster(raster)
+    root.editSegmentSelectionWithVariableWidthContour(
+        shapely.geometry.Point(250, 170).buffer(60), True, False
+    )
+    nodes, _ = root.getPreOrderNodes()
+    covered = raster.getCoveredPixels([node.selected for node in nodes])
+    union = root.getSelectionUnion()
+    assert union.is_valid
+    assert union.area == covered[raster.leaf].sum() > 0
+
+
+def test_findMissingChildren(monkeypatch):
+    img_file = osp.join(data_dir, "raw/2011_000003.jpg")
+    root, _ = labelme.segmentationTree.createSegTree(img_file)
+    missing = root.findMissingChildren()
+    assert missing
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=2, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        parallel = root.findMissingChildren(executor)
+    assert [node for node, _ in parallel] == [node for node, _ in missing]
+    for (_, polygons), (_, parallel_polygons) in zip(missing, parallel):
+        assert all(a.equals(b) for a, b in zip(polygons, parallel_polygons))
+
+    num_nodes = len(root.getPreOrderNodes()[0])
+    root.addMissingChildren(missing)
+    assert len(root.getPreOrderNodes()[0]) == num_nodes + sum(
+        len(polygons) for _, polygons in missing
+    )
+
+    # aborting from progress cancels the chunks not started yet
+    num_chunks = labelme.segmentationTree.MISSING_CHILDREN_CHUNKS
+    messages = []
+
+    def progress(message):
+        messages.append(message)
+        if len(messages) > 1:
+            raise labelme.segmentationTreeLoader.SegTreeLoadCancelled
+
+    num_run = []
+    findMissingPolygonsOfNodes = (
+        labelme.segmentationTree.findMissingPolygonsOfNodes
+    )
+
+    def countingFindMissingPolygonsOfNodes(tasks):
+        num_run.append(len(tasks))
+        return findMissingPolygonsOfNodes(tasks)
+
+    monkeypatch.setattr(
+        labelme.segmentationTree,
+        "findMissingPolygonsOfNodes",
+        countingFindMissingPolygonsOfNodes,
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(
+            labelme.segmentationTreeLoader.SegTreeLoadCancelled
+        ):
+            root.findMissingChildren(executor, progress)
+    assert messages[0].endswith("(0/{})".format(num_chunks))
+    assert len(num_run) < num_chunks
+    messages.clear()
+    with pytest.raises(labelme.segmentationTreeLoader.SegTreeLoadCancelled):
+        root.findMissingChildren(None, progress)
+    assert len(messages) == 2
@@ -0,0 +1,88 @@
+import math
+
+from qtpy import QtCore
+
+from labelme.shape import Shape
+
+
+def test_Shape_pathCache():
+    shape = Shape(shape_type="polygon")
+    for x, y in [(0, 0), (10, 0), (10, 10), (0, 10)]:
+        shape.addPoint(QtCore.QPointF(x, y))
+    shape.close()
+
+    path = shape.makePath()
+    assert shape.makePath() is path
+    assert shape.boundingRect() == QtCore.QRectF(0, 0, 10, 10)
+    assert shape.containsPoint(QtCore.QPointF(5, 5))
+
+    shape.moveBy(QtCore.QPointF(20, 0))
+    assert shape.makePath() is not path
+    assert shape.boundingRect() == QtCore.QRectF(20, 0, 10, 10)
+    assert not shape.containsPoint(QtCore.QPointF(5, 5))
+
+    shape.moveVertexBy(2, QtCore.QPointF(10, 10))
+    assert shape.boundingRect() == QtCore.QRectF(20, 0, 20, 20)
+    shape.insertPoint(1, QtCore.QPointF(25, -10))
+    assert shape.boundingRect() == QtCore.QRectF(20, -10, 20, 30)
+    shape.removePoint(1)
+    shape[0] = QtCore.QPointF(15, 0)
+    assert shape.boundingRect() == QtCore.QRectF(15, 0, 25, 20)
+
+    vertex_path = shape.getVertexPath()
+    assert shape.getVertexPath() is vertex_path
+    shape.highlightVertex(0, Shape.MOVE_VERTEX)
+    assert shape.getVertexPath() is not vertex_path
+
+    copied = shape.copy()
+    assert copied.boundingRect() == shape.boundingRect()
+    copied.moveBy(QtCore.QPointF(1, 0))
+    assert copied.boundingRect() != shape.boundingRect()
+
+
+def test_Shape_nearestVertexEdge():
+    shape = Shape(shape_type="polygon")
+    for x, y in [(0, 0), (10, 0), (10, 10), (10, 10), (0, 10)]:
+        shape.addPoint(QtCore.QPointF(x, y))
+    shape.close()
+
+    assert shape.nearestVertex(QtCore.QPointF(9, 1), 2) == 1
+    assert shape.nearestVertex(QtCore.QPointF(5, 5), 2) is None
+    # edge i goes from vertex i - 1 to vertex i, 0 closes the polygon
+    assert shape.nearestEdge(QtCore.QPointF(5, 1), 2) == 1
+    assert shape.nearestEdge(QtCore.QPointF(1, 5), 2) == 0
+    # the repeated vertex makes an empty edge, which is not near
+    assert shape.nearestEdge(QtCore.QPointF(5, 5), 2) is None
+    assert shape.nearestEdge(QtCore.QPointF(50, 50), 2) is None
+
+    shape.moveBy(QtCore.QPointF(100, 0))
+    assert shape.nearestVertex(QtCore.QPointF(9, 1), 2) is None
+    assert shape.nearestVertex(QtCore.QPointF(109, 1), 2) == 1
+
+
+def test_Shape_getLinePath_simplified():
+    shape = Shape(shape_type="polygon")
+    for i in range(1000):
+        angle = 2 * math.pi * i / 1000
+        shape.addPoint(
+            QtCore.QPointF(100 * math.cos(angle), 100 * math.sin(angle))
+        )
+    shape.close()
+
+    # the scale is shared by all shapes
+    scale = Shape.scale
+    try:
+        Shape.scale = 1.0
+        assert shape.getSimplifyTolerance() == 0
+        Shape.scale = 0.1
+        tolerance = shape.getSimplifyTolerance()
+        assert tolerance == 4
+        path = shape.getLinePath(tolerance)
+        assert shape.getLinePath(tolerance) is path
+        assert path.elementCount() < 100
+        assert path.boundingRect().contains(QtCore.QRectF(-99, -99, 198, 198))
+    finally:
+        Shape.scale = scale
+
+    shape.moveBy(QtCore.QPointF(10, 0))
+    assert shape.getLinePath(tolerance) is not path
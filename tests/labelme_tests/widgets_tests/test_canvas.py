@@ -0,0 +1,90 @@
+import pytest
+from qtpy import QtCore
+from qtpy import QtGui
+from shapely.geometry import Polygon
+
+from labelme.shape import Shape
+from labelme.widgets import Canvas
+
+
+@pytest.mark.gui
+def test_Canvas_paintSegTreeSelectionUnaryUnion(qtbot):
+    canvas = Canvas()
+    qtbot.addWidget(canvas)
+    pixmap = QtGui.QPixmap(100, 100)
+    pixmap.fill(QtCore.Qt.white)
+    canvas.loadPixmap(pixmap)
+
+    canvas.segmentation_tree_selection_unary_union = [
+        Polygon(
+            [(10, 10), (90, 10), (90, 90), (10, 90)],
+            [[(40, 40), (60, 40), (60, 60), (40, 60)]],
+        )
+    ]
+    path = canvas.getSegTreeSelectionPath()
+    assert path.contains(QtCore.QPointF(20, 20))
+    assert not path.contains(QtCore.QPointF(50, 50))
+
+    base, blink = QtGui.QColor(255, 0, 0, 128), QtGui.QColor(0, 0, 255, 128)
+    overlay = canvas.getSegTreeSelectionOverlay(base)
+    assert canvas.getSegTreeSelectionOverlay(base) is overlay
+    assert canvas.getSegTreeSelectionOverlay(blink) is not overlay
+    assert QtGui.qAlpha(overlay.pixel(20, 20)) > 0
+    assert QtGui.qAlpha(overlay.pixel(50, 50)) == 0
+
+    canvas.segmentation_tree_selection_unary_union = []
+    assert canvas.getSegTreeSelectionPath().isEmpty()
+    assert canvas.getSegTreeSelectionOverlay(base) is not overlay
+
+
+def makeRectangle(x0, y0, x1, y1):
+    shape = Shape(shape_type="rectangle")
+    shape.addPoint(QtCore.QPointF(x0, y0))
+    shape.addPoint(QtCore.QPointF(x1, y1))
+    shape.close()
+    return shape
+
+
+@pytest.mark.gui
+def test_Canvas_shapeIndex(qtbot):
+    canvas = Canvas()
+    qtbot.addWidget(canvas)
+    pixmap = QtGui.QPixmap(1000, 1000)
+    pixmap.fill(QtCore.Qt.white)
+    canvas.loadPixmap(pixmap)
+
+    bottom = makeRectangle(100, 100, 300, 300)
+    top = makeRectangle(200, 200, 400, 400)
+    far = makeRectangle(800, 800, 900, 900)
+    canvas.loadShapes([bottom, top, far])
+
+    index = canvas.shapeIndex
+    assert index.shapesNear(QtCore.QPointF(250, 250)) == [top, bottom]
+    assert index.shapesNear(QtCore.QPointF(150, 150)) == [bottom]
+    assert index.shapesNear(QtCore.QPointF(95, 150)) == []
+    assert index.shapesNear(QtCore.QPointF(95, 150), margin=10) == [bottom]
+    # painting order, only the shapes meeting the rect
+    assert index.shapesIn(0, 0, 500, 500) == [bottom, top]
+    assert index.shapesIn(350, 0, 1000, 1000) == [top, far]
+    exposed = canvas.getExposedImageRect(QtCore.QRect(0, 0, 100, 100))
+    assert exposed == QtCore.QRectF(0, 0, 100, 100)
+
+    # moved shapes keep their place in the z-order
+    canvas.prevPoint = QtCore.QPointF(850, 850)
+    canvas.boundedMoveShapes([far], QtCore.QPointF(300, 300))
+    assert index.shapesNear(QtCore.QPointF(250, 250)) == [far, top, bottom]
+
+    canvas.deleteShape(top)
+    assert index.shapesNear(QtCore.QPointF(250, 250)) == [far, bottom]
+
+    # shapes spanning many cells are not spread over the grid
+    large = makeRectangle(0, 0, 999, 999)
+    canvas.loadShapes([bottom, large])
+    assert index.shapesNear(QtCore.QPointF(150, 150)) == [large, bottom]
+    assert index.shapesIn(600, 600, 700, 700) == [large]
+    assert large in index.large
+    assert large not in index.shape_cells
+    canvas.prevPoint = QtCore.QPointF(500, 500)
+    canvas.boundedMoveShapes([large], QtCore.QPointF(499, 499))
+    assert index.large == {large}
+    assert index.shapesNear(QtCore.QPointF(150, 150)) == [large, bottom]